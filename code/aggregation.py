@@ -0,0 +1,81 @@
+# Streaming aggregation of the wind speed archive ../data/<institution>/<experiment>/S/.
+# The yearly files are read month by month, and every month of data is handed to all
+# registered reducers before the next one is read. Several products (e.g. monthly
+# means, sub-daily focus areas, July midnight means) are thus computed from a single
+# pass over the archive. Reducers are defined next to the scripts that use them.
+
+import glob
+import os
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+data_dir = "../data/"
+
+
+class Reducer:
+    """
+    Base class of reducers used by stream_archive.
+
+    update(ds): called with one month of (loaded) wind speeds, in chronological order
+    end_year(institution, experiment, year, filename): called after the last month
+        of each yearly file (optional)
+    save(institution, experiment): store the result after the last update
+    """
+
+    def update(self, ds):
+        raise NotImplementedError
+
+    def end_year(self, institution, experiment, year, filename):
+        pass
+
+    def save(self, institution, experiment):
+        raise NotImplementedError
+
+
+def yearly_files(institution, experiment):
+    """
+    Yearly wind speed files of an experiment in chronological order
+    :return: list of (year, filename)
+    """
+    filenames = glob.glob(data_dir + institution + "/" + experiment + "/S/*.nc")
+    # file names end with the year (IDL: 1986.nc, GERICS: S_1986.nc)
+    return sorted((int(os.path.basename(f)[-7:-3]), f) for f in filenames)
+
+
+def decode_time(ds, institution, year):
+    """
+    GERICS time index needs modification to be understood by xarray (6h steps from
+    the beginning of the year)
+    """
+    if institution == "GERICS":
+        ds["time"] = pd.date_range(
+            start=str(year) + "0101", periods=ds.time.size, freq="6h"
+        )
+    return ds
+
+
+def stream_archive(institution, experiment, reducers, years=None):
+    """
+    Read the wind speed archive of one institution and experiment once and update all
+    reducers with each month of data
+    :param reducers: list of Reducer
+    :param years: years to include, defaults to all yearly files
+    """
+    files = yearly_files(institution, experiment)
+    if not files:
+        raise FileNotFoundError("No wind speeds for " + institution + " " + experiment)
+    for year, filename in files:
+        if years is not None and year not in years:
+            continue
+        print(institution + " " + experiment + " " + str(year))
+        with xr.open_dataset(filename) as ds:
+            ds = decode_time(ds, institution, year)
+            for month in np.unique(ds["time.month"].values):
+                ds_month = ds.sel(time=ds["time.month"] == month).load()
+                for reducer in reducers:
+                    reducer.update(ds_month)
+        for reducer in reducers:
+            reducer.end_year(institution, experiment, year, filename)
+    for reducer in reducers:
+        reducer.save(institution, experiment)
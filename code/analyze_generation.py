@@ -6,14 +6,73 @@ import pandas as pd
 import seaborn as sns
 import xarray as xr
 import matplotlib.pyplot as plt
+import glob
+import os
+from timeseries_store import CF_store, open_store, select_year
+from histograms import histograms
+from result_cache import cached
 
 data_path = "../output/generation/"
+downsampled_means = {}  # 6h means of IDL per experiment, see downsample_IDL
 
 ##################################
 # Computing functions
 ##################################
 
 
+def open_CF(ins, experiment, year=None, turbine_name="SWT120_3600", preprocess=None):
+    """
+    Open capacity factors of all years (or one year) from the consolidated store of
+    compute_power.py, falling back to the yearly NetCDF files if there is no store
+
+    preprocess: function applied to the lazily opened data (per file if there is no
+        store), e.g. utils.select_synoptic_times
+    """
+    store = CF_store(ins, experiment, turbine_name)
+    if os.path.exists(store):
+        ds = open_store(store)
+        if year is not None:
+            ds = select_year(ds, year)
+        if preprocess is not None:
+            ds = preprocess(ds)
+        return ds
+    filename = data_path + ins + "_" + turbine_name + "*"
+    if year is None:
+        filename += experiment + ".nc"
+    else:
+        filename += str(year) + "*" + experiment + ".nc"
+    return xr.open_mfdataset(filename, preprocess=preprocess)
+
+
+def CF_inputs(ins, experiment, turbine_name="SWT120_3600"):
+    """
+    Files read by open_CF for all years (the store or the yearly NetCDF files)
+    """
+    store = CF_store(ins, experiment, turbine_name)
+    if os.path.exists(store):
+        return [store]
+    return sorted(
+        glob.glob(data_path + ins + "_" + turbine_name + "*" + experiment + ".nc")
+    )
+
+
+def CF_mean(ins, experiment):
+    """
+    Time mean of the capacity factors, cached on disk (see result_cache.py)
+    """
+
+    def _compute():
+        ds = open_CF(ins, experiment).rename({"S_hub": "CF SWT120-3600"})
+        return ds["CF SWT120-3600"].mean(dim="time").compute().to_dataset(name="mean")
+
+    return cached(
+        "CF_mean",
+        CF_inputs(ins, experiment),
+        _compute,
+        {"ins": ins, "experiment": experiment},
+    )
+
+
 def build_CF_dict(downsample=False):
     """
     Build up a big dataset that contains means of wind power generation
@@ -30,57 +89,41 @@ def build_CF_dict(downsample=False):
             if (downsample) & (ins == "IDL"):
                 ds_tmp = downsample_IDL(experiment)
             else:
-                ds = xr.open_mfdataset(
-                    data_path + ins + "*" + experiment + ".nc"
-                ).rename({"S_hub": "CF SWT120-3600"})
-                ds_tmp = (
-                    ds["CF SWT120-3600"]
-                    .mean(dim="time")
-                    .compute()
-                    .to_dataset(name="mean")
-                )
+                ds_tmp = CF_mean(ins, experiment)
             ds_dict[ins][experiment] = ds_tmp
     return ds_dict
 
 
 def downsample_IDL(experiment):
     """
-    Downsample hourly IDL capacity factors to 6h and then compute means
+    Downsample hourly IDL capacity factors to 6h and then compute means. Only the
+    timesteps at 00, 06, 12 and 18 UTC are read and the means are kept for reuse
+    (in memory and on disk, see result_cache.py).
     """
     assert experiment in ["GRASS", "FOREST"]
-    ds = xr.open_mfdataset(data_path + "IDL" + "*" + experiment + ".nc").rename(
-        {"S_hub": "CF SWT120-3600"}
-    )
-    ds = ds.isel(time=np.arange(0, ds.time.size, 6))  # sample every 6th value
-    ds = ds["CF SWT120-3600"].mean(dim="time").compute().to_dataset(name="mean")
-    return ds
 
+    def _compute():
+        ds = open_CF("IDL", experiment, preprocess=select_synoptic_times)
+        ds = ds.rename({"S_hub": "CF SWT120-3600"})
+        return ds["CF SWT120-3600"].mean(dim="time").compute().to_dataset(name="mean")
 
-def construct_histogram_data(ins, experiment, bins):
-    """
-    On a per timestep basis, commpute histogramm data for pre-defined bins.
-    For memory reasons, the computation is executed seperately per year and
-    counts are summed up.
+    if experiment not in downsampled_means:
+        downsampled_means[experiment] = cached(
+            "CF_mean_6h",
+            CF_inputs("IDL", experiment),
+            _compute,
+            {"experiment": experiment, "hours": synoptic_hours},
+            [select_synoptic_times],
+        )
+    return downsampled_means[experiment]
 
-    ins: name of the institution, either "GERICS" or "IDL"
-    experiment: "FOREST" or "GRASS"
-    bins: array of bins to be used for the computation of te histograms
+
+def histogram_dataframe(counts, bins, ins, experiment):
+    """
+    Counts per bin of one institution and experiment as pandas DataFrame
     """
-    for year in range(1986, 2016):  # all years under consideration
-        if year in [1990, 2000, 2010]:  # visualize progress
-            print(year)
-        ds = xr.open_mfdataset(
-            data_path + ins + "*" + str(year) + "*" + experiment + ".nc"
-        )
-        ds_land = restrict_to_land(ds, monthly=False, variable_name="S_hub")
-        da_land = ds_land["S_hub"].values
-        n, bins = np.histogram(da_land[np.isfinite(da_land)], bins=bins)
-        if year == 1986:
-            n_sum = n
-        else:
-            n_sum += n
     df = pd.DataFrame(
-        data=n_sum,
+        data=counts,
         index=pd.Index(name="CF", data=np.round(bins[1:], 2)),
         columns=["count"],
     )
@@ -91,17 +134,88 @@ def construct_histogram_data(ins, experiment, bins):
     return df
 
 
-def compute_concatenated_histograms(save=True):
+def construct_histogram_data(ins, experiment, bins, years=range(1986, 2016)):
+    """
+    On a per timestep basis, commpute histogramm data for pre-defined bins.
+    Onshore values are counted chunk by chunk (see histograms.py), the selected
+    years are only opened lazily.
+
+    ins: name of the institution, either "GERICS" or "IDL"
+    experiment: "FOREST" or "GRASS"
+    bins: array of uniform bins to be used for the computation of te histograms
+    years: years under consideration
+    """
+    ds = xr.concat([open_CF(ins, experiment, year) for year in years], dim="time")
+    ds = crop_to_land_sea_mask(ds)
+    counts = histograms(
+        {"CF": ds["S_hub"]},
+        {"CF": bins},
+        masks={"CF": get_land_sea_mask(ds, monthly=False).mask},
+    )
+    return histogram_dataframe(counts[("CF", "CF", None)], bins, ins, experiment)
+
+
+def compute_concatenated_histograms(
+    save=True, bin_sets=None, by_season=False, turbine_names=["SWT120_3600"]
+):
     """
     Loop over combinations of institutions and experiment to build
-    up a dataframe
+    up a dataframe. All histograms are computed from one read of the capacity factors.
+
+    bin_sets: dictionary name -> uniform bins, defaults to 0.05 wide bins from 0 to 1.
+        A column "bins" is added if there is more than one bin set.
+    by_season: if True, histograms per season are added (column "season")
+    turbine_names: turbines to include, column "turbine" is added if there are several
     """
-    bins = np.arange(0, 1.01, 0.05)
-    df_1 = construct_histogram_data("GERICS", "FOREST", bins)
-    df_2 = construct_histogram_data("GERICS", "GRASS", bins)
-    df_3 = construct_histogram_data("IDL", "FOREST", bins)
-    df_4 = construct_histogram_data("IDL", "GRASS", bins)
-    df = pd.concat([df_1, df_2, df_3, df_4])
+    if bin_sets is None:
+        bin_sets = {"default": np.arange(0, 1.01, 0.05)}
+
+    def _compute():
+        sources, masks, seasons = {}, {}, {}
+        for ins in ["GERICS", "IDL"]:
+            for experiment in ["FOREST", "GRASS"]:
+                for turbine_name in turbine_names:
+                    ds = crop_to_land_sea_mask(
+                        open_CF(ins, experiment, turbine_name=turbine_name)
+                    )
+                    key = (ins, experiment, turbine_name)
+                    sources[key] = ds["S_hub"]
+                    masks[key] = get_land_sea_mask(ds, monthly=False).mask
+                    if by_season:
+                        seasons[key] = ds["time.season"].values
+        counts = histograms(sources, bin_sets, masks, seasons)
+        df_list = []
+        for ins, experiment, turbine_name in sources:
+            for bins_name, bins in bin_sets.items():
+                groups = [None] + (["DJF", "MAM", "JJA", "SON"] if by_season else [])
+                for season in groups:
+                    n = counts.get(
+                        ((ins, experiment, turbine_name), bins_name, season),
+                        np.zeros(len(bins) - 1, dtype=int),
+                    )
+                    df = histogram_dataframe(n, bins, ins, experiment)
+                    if by_season:
+                        df["season"] = "full year" if season is None else season
+                    if len(bin_sets) > 1:
+                        df["bins"] = bins_name
+                    if len(turbine_names) > 1:
+                        df["turbine"] = turbine_name
+                    df_list.append(df)
+        return pd.concat(df_list)
+
+    inputs = [
+        f
+        for ins in ["GERICS", "IDL"]
+        for experiment in ["FOREST", "GRASS"]
+        for turbine_name in turbine_names
+        for f in CF_inputs(ins, experiment, turbine_name)
+    ]
+    params = {
+        "bin_sets": bin_sets,
+        "by_season": by_season,
+        "turbine_names": turbine_names,
+    }
+    df = cached("CF_histograms", inputs, _compute, params, [histograms])
     if save:
         df.to_csv("../output/CF_histograms.csv")
     return df
@@ -187,7 +301,7 @@ def plot_relative_change(ds_dict):
     cbar_ax = f.add_axes([0.1, 0.07, 0.8, 0.03])
     for i, ins in enumerate(["GERICS", "IDL", "IDL-6h"]):
         if ins == "IDL-6h":
-            print("Downsampling hourly IDL to 6h, this takes a minute or so.")
+            print("Downsampling hourly IDL to 6h.")
             ds_grass = downsample_IDL("GRASS")["mean"]
             print("Grass done")
             ds_forest = downsample_IDL("FOREST")["mean"]
@@ -4,7 +4,8 @@ import pandas as pd
 import seaborn as sns
 import numpy as np
 import matplotlib.colors as mcolors
-
+from online_statistics import SEASONS, change_statistics
+from quantile_sketch import QuantileSketch
 
 plt.rc("axes.spines", top=False, right=False)
 
@@ -22,42 +23,81 @@ def select_lowest_level(ds, institution):
     return ds.sel({vertical_name: min_level})
 
 
-def calculate_changes(s_dict, relative=False, season=None, onshore=False, monthly=True):
+def season_label(season):
     """
-    Calculates changes between GRASS and FOREST and returns as pandas DataFrame for plotting
-    with seaborn.
+    Label of a season in the changes arrays, "full year" for None
+    """
+    if season is None:
+        return "full year"
+    return season
 
-    If relative is set to True, changes are reported relative to the change in the lowermost level.
 
-    relative: True or False
-    season: None (i.e., year-round), "DJF", "MAM", "JJA", "SON"
+def compute_changes(s_dict, relative=False, onshore=False, monthly=True, stats=None):
     """
-    df_list = []
+    Calculates changes between GRASS and FOREST for the full year and all seasons and
+    returns them as labelled arrays.
+
+    If relative is set to True, changes are reported relative to the mean change in the
+    lowermost level (per season).
+
+    stats: output of online_statistics.change_statistics(s_dict), computed if None
+    :return: dictionary institution -> xr.DataArray "S" with dimensions season
+        ("full year", "DJF", "MAM", "JJA", "SON"), height (approximate height in m),
+        rlat and rlon
+    """
+    if stats is None:
+        stats = change_statistics(s_dict)
+    seasons = [None] + SEASONS
+    changes = {}
     for institution in institutions:
-        ds_tmp = s_dict[institution]
-        if onshore:
-            ds_tmp = restrict_to_land(ds_tmp, monthly)
-        if season:
-            ds_tmp = (
-                ds_tmp.groupby("time.season").mean().sel(season=season).drop("season")
-            )
-        else:
-            ds_tmp = ds_tmp.mean(dim="time")
-        ds_tmp = ds_tmp.drop(["lat", "lon"], errors="ignore")
-        diff = ds_tmp.sel({"experiment": "GRASS"}) - ds_tmp.sel(
-            {"experiment": "FOREST"}
+        diff = xr.concat(
+            [stats[institution].difference(season) for season in seasons],
+            pd.Index([season_label(season) for season in seasons], name="season"),
         )
+        if onshore:
+            diff = restrict_to_land(diff.to_dataset(name="S"), monthly)["S"]
+        diff = diff.drop_vars(["lat", "lon"], errors="ignore")
         if relative:
-            diff /= select_lowest_level(diff, institution).mean()
-        df = diff["S"].to_dataframe()
-        df = df.reset_index(["rlat", "rlon"])  # seperate z, rlat, rlon multiindex
-        df.index = pd.Index(
-            name="height", data=[approximate_heights[institution][x] for x in df.index]
-        )
+            diff = diff / select_lowest_level(diff, institution).mean(["rlat", "rlon"])
+        vertical_dim = vertical_dim_dic[institution]
+        heights = [
+            approximate_heights[institution][x] for x in diff[vertical_dim].values
+        ]
+        diff = diff.assign_coords(height=(vertical_dim, heights))
+        diff = diff.swap_dims({vertical_dim: "height"}).drop_vars(vertical_dim)
+        changes[institution] = diff.transpose("season", "height", "rlat", "rlon")
+    return changes
+
+
+def changes_to_dataframe(changes, season=None):
+    """
+    Convert changes of one season (see compute_changes) to a pandas DataFrame for
+    plotting with seaborn. Grid cells without data (e.g. offshore) are dropped.
+    """
+    df_list = []
+    for institution, da in changes.items():
+        df = da.sel(season=season_label(season), drop=True).to_dataframe(name="S")
+        df = df.dropna().reset_index(["rlat", "rlon"])
         df["institution"] = institution
         df_list.append(df)
-    df = pd.concat(df_list)
-    return df
+    return pd.concat(df_list)
+
+
+def calculate_changes(
+    s_dict, relative=False, season=None, onshore=False, monthly=True, stats=None
+):
+    """
+    Calculates changes between GRASS and FOREST and returns as pandas DataFrame for plotting
+    with seaborn.
+
+    If relative is set to True, changes are reported relative to the change in the lowermost level.
+
+    relative: True or False
+    season: None (i.e., year-round), "DJF", "MAM", "JJA", "SON"
+    stats: output of online_statistics.change_statistics(s_dict), computed if None
+    """
+    changes = compute_changes(s_dict, relative, onshore, monthly, stats)
+    return changes_to_dataframe(changes, season)
 
 
 def load_monthly_data_dictionary():
@@ -77,26 +117,24 @@ def load_monthly_data_dictionary():
     return s_dict
 
 
-def compute_mean_onshore_surface_change(s_dict):
+def compute_mean_onshore_surface_change(s_dict, stats=None):
     """
     Compute the absolute wind speed change in the lowest model level
     in IDL and GERICS
+
+    stats: output of online_statistics.change_statistics(s_dict), computed if None
     """
+    if stats is None:
+        stats = change_statistics(s_dict)
     mean_land = {}
     for experiment in ["GRASS", "FOREST"]:
         if not experiment in mean_land.keys():
             mean_land[experiment] = {}
         mean_land[experiment]["IDL"] = float(
-            restrict_to_land(s_dict["IDL"])
-            .mean(dim=["time", "rlat", "rlon"])
-            .isel(mlev=0)
-            .sel(experiment=experiment)["S"]
+            stats["IDL"].region_mean(experiment, region="onshore").isel(mlev=0)
         )
         mean_land[experiment]["GERICS"] = float(
-            restrict_to_land(s_dict["GERICS"])
-            .mean(dim=["time", "rlat", "rlon"])
-            .sel(lev=27.0)
-            .sel(experiment=experiment)["S"]
+            stats["GERICS"].region_mean(experiment, region="onshore").sel(lev=27.0)
         )
     return mean_land
 
@@ -230,20 +268,21 @@ def plot_maps_per_height_paper(s_dict, season=None):
 ##########################################
 # Statistics as a table
 ##########################################
-def stats_per_height(s_dict):
+def stats_per_height(s_dict, stats=None):
     """
     Computes key statistics per height level and outputs as a
     latex table
 
     Assumes that GERICS and IDL are on the same grid. That is, the additional
     two grid box slices in GERISC have to be already removed.
+
+    stats: output of online_statistics.change_statistics(s_dict), computed if None
     """
+    if stats is None:
+        stats = change_statistics(s_dict)
     for ins in ["GERICS", "IDL"]:
-        # Open data
-        diff = s_dict[ins].sel(experiment="GRASS") - s_dict[ins].sel(
-            experiment="FOREST"
-        )
-        diff = diff.mean(dim="time")
+        # Time mean change
+        diff = stats[ins].difference().to_dataset(name="S")
         diff_land = restrict_to_land(diff, monthly=True)
 
         # on and offshore means
@@ -324,10 +363,37 @@ def plot_path(relative):
         return "../plots/exploration/absolute_differences/"
 
 
-def plot_decay_quantiles_all(s_dict):
+def decay_quantile_sketches(changes, k=200, block_size=10):
     """
-    Plot signal decay (GRASS-FOREST) at heights below 400m
-    seperated by model, season, and quantile
+    Quantile sketches of changes per institution, season and height, filled in one
+    pass over blocks of block_size rlat rows. The changes of compute_changes are
+    already in memory, the sketches only approximate their quantiles.
+
+    changes: output of compute_changes
+    k: accuracy of the sketches (see quantile_sketch.QuantileSketch)
+    :return: dictionary (institution, season, height) -> QuantileSketch
+    """
+    sketches = {}
+    for institution, da in changes.items():
+        for season in da.season.values:
+            for height in da.height.values:
+                sketch = QuantileSketch(k)
+                da_height = da.sel(season=season, height=height)
+                for i in range(0, da_height.rlat.size, block_size):
+                    sketch.update(da_height.isel(rlat=slice(i, i + block_size)).values)
+                sketches[(institution, season, height)] = sketch
+    return sketches
+
+
+def compute_decay_quantiles(s_dict, stats=None, method="exact"):
+    """
+    Quantiles of the onshore changes (GRASS-FOREST) per institution, height and
+    season, averaged over a small percentile band around each quantile
+
+    stats: output of online_statistics.change_statistics(s_dict), computed if None
+    method: "exact" (quantiles of all grid cells) or "sketch" (quantile sketches,
+        rank error below about 1 %, see quantile_sketch.py). The changes are held in
+        memory either way, so the sketches do not reduce memory here.
     """
 
     def _compute_offsets(N=10, width=10):
@@ -341,36 +407,64 @@ def plot_decay_quantiles_all(s_dict):
         offsets *= width  # scale to cover desired width
         return offsets
 
+    if method not in ["sketch", "exact"]:
+        raise ValueError("Unknown method " + str(method))
+    changes = compute_changes(s_dict, onshore=True, monthly=True, stats=stats)
+    if method == "sketch":
+        sketches = decay_quantile_sketches(changes)
+    index = pd.MultiIndex.from_tuples(
+        sorted(
+            (institution, height)
+            for institution, da in changes.items()
+            for height in da.height.values
+        ),
+        names=["institution", "height"],
+    )
     df_list = []
     for season in ["DJF", "MAM", "JJA", "SON", None]:
-        df = calculate_changes(
-            s_dict=s_dict,
-            relative=False,
-            season=season,
-            onshore=True,
-            monthly=True,
-        )
         for quantile in [0.1, 0.5, 0.9]:
             offsets = _compute_offsets(width=10)
-            df_tmp_list = []
-            for offset in offsets:
-                df_tmp_list.append(
-                    df.groupby(["institution", "height"])
-                    .quantile(quantile + offset)
-                    .drop(columns=["rlat", "rlon"])
+            if method == "exact":
+                values = {
+                    institution: da.sel(season=season_label(season), drop=True)
+                    .quantile(quantile + offsets, dim=["rlat", "rlon"])
+                    .transpose("height", "quantile")
+                    for institution, da in changes.items()
+                }
+                values = np.array(
+                    [
+                        values[institution].sel(height=height).values
+                        for institution, height in index
+                    ]
                 )
-            df_tmp = pd.concat(df_tmp_list)
-            S_mean = df_tmp.groupby(["institution", "height"]).mean()
-            S_std = df_tmp.groupby(["institution", "height"]).std()
-            S_mean["S_std"] = S_std
-            df_tmp = S_mean  # rename to align with previous name convention
-            if season == None:
-                df_tmp["season"] = "full year"
             else:
-                df_tmp["season"] = season
+                values = np.array(
+                    [
+                        sketches[(institution, season_label(season), height)].quantile(
+                            quantile + offsets
+                        )
+                        for institution, height in index
+                    ]
+                )
+            df_tmp = pd.DataFrame(
+                {"S": values.mean(axis=1), "S_std": values.std(axis=1, ddof=1)},
+                index=index,
+            )
+            df_tmp["season"] = season_label(season)
             df_tmp["quantile"] = quantile
             df_list.append(df_tmp)
-    df_combined = pd.concat(df_list)
+    return pd.concat(df_list)
+
+
+def plot_decay_quantiles_all(s_dict, stats=None, method="exact"):
+    """
+    Plot signal decay (GRASS-FOREST) at heights below 400m
+    seperated by model, season, and quantile
+
+    stats: output of online_statistics.change_statistics(s_dict), computed if None
+    method: "exact" or "sketch", see compute_decay_quantiles
+    """
+    df_combined = compute_decay_quantiles(s_dict, stats, method)
     ###########
     # Plotting
     ###########
@@ -437,13 +531,30 @@ def plot_decay_quantiles_all(s_dict):
     plt.savefig(plot_path(relative=False) + "/Signal_decay_quantiles_all.jpeg", dpi=600)
 
 
-def plot_signal_decay_mean_log(s_dict, relative=False, onshore=False, monthly=True):
-    df = calculate_changes(
-        s_dict=s_dict, relative=relative, onshore=onshore, monthly=monthly
+def plot_signal_decay_mean_log(
+    s_dict, relative=False, onshore=False, monthly=True, stats=None
+):
+    if stats is None:
+        stats = change_statistics(s_dict)
+    changes = compute_changes(
+        s_dict=s_dict,
+        relative=relative,
+        onshore=onshore,
+        monthly=monthly,
+        stats=stats,
     )
     # Looking at the mean in log-log plot using relative height
-    df_mean = df.groupby(["institution", "height"]).mean()
-    df_mean = df_mean.reset_index(["height"])
+    df_mean = pd.concat(
+        [
+            da.sel(season=season_label(None), drop=True)
+            .mean(["rlat", "rlon"])
+            .to_dataframe(name="S")
+            .assign(institution=institution)
+            for institution, da in changes.items()
+        ]
+    )
+    df_mean = df_mean.reset_index().sort_values(["institution", "height"])
+    df_mean = df_mean.set_index("institution")
     df_min = df_mean.reset_index().groupby("institution")["height"].min()
     df_mean["relative_height"] = df_mean["height"] / df_min
 
@@ -486,7 +597,7 @@ def plot_signal_decay_mean_log(s_dict, relative=False, onshore=False, monthly=Tr
             z_low = 30
         else:
             z_low = 28
-        mean_land = compute_mean_onshore_surface_change(s_dict)
+        mean_land = compute_mean_onshore_surface_change(s_dict, stats)
         grass_profile = log_law(
             np.arange(1, 30), roughness_dict[ins]["C3"], z_low=z_low
         )
@@ -597,6 +708,7 @@ if __name__ == "__main__":
         plot_maps_per_height_paper(s_dict, season=season)
     # Onshore decay computation needs corrections for GERICS because grid is too large
     s_dict["GERICS"] = s_dict["GERICS"].isel(rlat=slice(0, -1), rlon=slice(0, -1))
-    stats_per_height(s_dict)
-    plot_decay_quantiles_all(s_dict)
-    plot_signal_decay_mean_log(s_dict, relative=True, onshore=True)
+    stats = change_statistics(s_dict)  # one pass over the data for all statistics
+    stats_per_height(s_dict, stats)
+    plot_decay_quantiles_all(s_dict, stats)
+    plot_signal_decay_mean_log(s_dict, relative=True, onshore=True, stats=stats)
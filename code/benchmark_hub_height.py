@@ -0,0 +1,70 @@
+# Benchmark of the hub height interpolation for several hub heights:
+# the xarray implementation (one full run per hub height) against the
+# multi-height kernel (power law exponent computed once for all heights).
+# Runs on a synthetic IDL-like dataset, no input data needed.
+
+import time
+import numpy as np
+import pandas as pd
+import xarray as xr
+from compute_hub_height import calculate_hub_height_xr, calculate_hub_height_chunked
+
+hub_heights = [80, 100, 120, 150]
+
+
+def synthetic_two_level_dataset(n_time=240, n_rlat=103, n_rlon=106, seed=0):
+    """
+    Wind speeds and heights above ground on the two lowest IDL levels (mlev 0 and 1)
+    on a EUR-44 sized grid
+    """
+    rng = np.random.default_rng(seed)
+    shape = (n_time, 2, n_rlat, n_rlon)
+    height = np.array([28.0, 95.0])[None, :, None, None] + rng.normal(0, 2, shape)
+    S = rng.uniform(1, 12, shape) * (height / 28.0) ** 0.14
+    return xr.Dataset(
+        {
+            "S": (("time", "mlev", "rlat", "rlon"), S),
+            "height": (("time", "mlev", "rlat", "rlon"), height),
+        },
+        coords={
+            "time": pd.date_range("2000-01-01", periods=n_time, freq="1h"),
+            "mlev": [0, 1],
+            "rlat": np.round(np.arange(n_rlat) * 0.44 - 23.21, 2),
+            "rlon": np.round(np.arange(n_rlon) * 0.44 - 28.21, 2),
+        },
+    )
+
+
+def benchmark(ds, hub_heights=hub_heights, repeats=3):
+    """
+    Returns the best of repeats runtimes [s] of both implementations (their
+    equivalence is tested in test_compute_hub_height.py)
+    """
+    times_xr, times_kernel = [], []
+    for _ in range(repeats):
+        t_0 = time.time()
+        ds_xr = xr.concat(
+            [
+                calculate_hub_height_xr(ds, "IDL", hub_height=h)["S_hub"].drop_vars(
+                    "mlev"
+                )
+                for h in hub_heights
+            ],
+            dim=pd.Index(hub_heights, name="hub_height"),
+        )
+        times_xr.append(time.time() - t_0)
+        t_0 = time.time()
+        ds_kernel = calculate_hub_height_chunked(ds, "IDL", hub_height=hub_heights)[
+            "S_hub"
+        ].compute()
+        times_kernel.append(time.time() - t_0)
+    return min(times_xr), min(times_kernel)
+
+
+if __name__ == "__main__":
+    ds = synthetic_two_level_dataset()
+    t_xr, t_kernel = benchmark(ds)
+    print("Hub heights: " + str(hub_heights))
+    print("xarray implementation: " + str(np.round(t_xr, 3)) + " s")
+    print("multi-height kernel: " + str(np.round(t_kernel, 3)) + " s")
+    print("speed-up: " + str(np.round(t_xr / t_kernel, 1)))
@@ -0,0 +1,238 @@
+# Benchmark suite for the processing pipeline.
+# Every stage is run on synthetic EUR-44 shaped datasets (see synthetic_data.py)
+# and timed. Throughput (grid cells x timesteps per second, MB of input per second)
+# and peak memory (as traced by tracemalloc) are stored as json in
+# ../output/benchmarks/ so that regressions between versions can be spotted.
+
+import contextlib
+import datetime
+import glob
+import json
+import os
+import platform
+import shutil
+import tempfile
+import time
+import tracemalloc
+
+import dask
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+import synthetic_data
+from power_curves import load_power_curves
+
+benchmark_dir = "../output/benchmarks/"
+
+
+def _size(ds):
+    """
+    Number of grid cells x timesteps (summed over variables) and size in MB
+    """
+    n_values = sum(ds[var].size for var in ds.data_vars if "time" in ds[var].dims)
+    return n_values, ds.nbytes / 1e6
+
+
+def run_stage(func, ds_in):
+    """
+    Time func (which needs to return computed results) and trace peak memory
+    :param func: function without arguments executing the stage
+    :param ds_in: input dataset(s) used to compute throughput
+    :return: dictionary with the measurements
+    """
+    if isinstance(ds_in, xr.Dataset):
+        ds_in = [ds_in]
+    n_values = sum(_size(ds)[0] for ds in ds_in)
+    megabytes = sum(_size(ds)[1] for ds in ds_in)
+    tracemalloc.start()
+    t_0 = time.perf_counter()
+    func()
+    seconds = time.perf_counter() - t_0
+    peak_memory = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {
+        "seconds": seconds,
+        "cells_timesteps_per_s": n_values / seconds,
+        "MB_per_s": megabytes / seconds,
+        "input_MB": megabytes,
+        "peak_memory_MB": peak_memory / 1e6,
+    }
+
+
+@contextlib.contextmanager
+def synthetic_workspace(grid_scale=1):
+    """
+    Temporary directory tree with code/, output/ and output/generation/ that is used as
+    working directory so that functions with hardcoded relative paths (e.g. the land
+    sea mask in utils.restrict_to_land) find synthetic inputs
+    """
+    cwd = os.getcwd()
+    root = tempfile.mkdtemp()
+    try:
+        os.makedirs(root + "/code")
+        os.makedirs(root + "/output/generation")
+        synthetic_data.land_sea_mask(grid_scale).to_netcdf(
+            root + "/output/land_sea_mask.nc"
+        )
+        os.chdir(root + "/code")
+        yield root
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(root)
+
+
+def run_benchmarks(n_days=7, grid_scale=1):
+    """
+    Run all stages and return the results
+    :param n_days: length of the synthetic time series (hourly for IDL, 6h for GERICS)
+    :param grid_scale: refinement of the EUR-44 grid
+    """
+    import preprocess_IDL
+    import preprocess_GERICS
+    import compute_monthly_winds
+    import compute_hub_height
+    import analyze_generation
+    from utils import restrict_to_land
+    from utils_from_CESM2energy import Power
+
+    load_power_curves()  # power curves are read before changing the directory
+    P = Power("SWT120_3600")
+    kwargs = {"n_days": n_days, "grid_scale": grid_scale}
+    results = {}
+
+    print("preprocess_IDL")
+    ds_IDL = synthetic_data.IDL_wind_components(**kwargs)
+    results["preprocess_IDL"] = run_stage(
+        lambda: preprocess_IDL.compute_wind_speed(ds_IDL.copy()).load(), ds_IDL
+    )
+
+    print("preprocess_GERICS")
+    ds_FI, ds_FIB = synthetic_data.GERICS_geopotential(**kwargs)
+    results["preprocess_GERICS_FI"] = run_stage(
+        lambda: preprocess_GERICS.interpolate_geopotential(ds_FI, ds_FIB).load(),
+        [ds_FI, ds_FIB],
+    )
+    ds_U, ds_V = synthetic_data.GERICS_wind_components(**kwargs)
+    results["preprocess_GERICS_S"] = run_stage(
+        lambda: preprocess_GERICS.compute_wind_speed(ds_U, ds_V).load(), [ds_U, ds_V]
+    )
+    del ds_FI, ds_FIB, ds_U, ds_V
+
+    print("compute_monthly_winds")
+    ds_S = preprocess_IDL.compute_wind_speed(ds_IDL.copy()).chunk({"time": 24})
+    results["compute_monthly_winds"] = run_stage(
+        lambda: compute_monthly_winds.compute_monthly_means(ds_S, "IDL"), ds_S
+    )
+    del ds_IDL, ds_S
+
+    print("compute_hub_height")
+    ds_wind = synthetic_data.hub_height_input("IDL", **kwargs)
+    results["compute_hub_height"] = run_stage(
+        lambda: compute_hub_height.calculate_hub_height_chunked(ds_wind, "IDL").load(),
+        ds_wind,
+    )
+    ds_hub = compute_hub_height.calculate_hub_height_chunked(ds_wind, "IDL").load()
+    del ds_wind
+
+    print("compute_power")
+    results["compute_power"] = run_stage(
+        lambda: P.convert(ds_hub["S_hub"]).load(), ds_hub
+    )
+    del ds_hub
+
+    ds_CF = synthetic_data.capacity_factors("IDL", **kwargs)
+    with synthetic_workspace(grid_scale):
+        print("restrict_to_land")
+        results["restrict_to_land"] = run_stage(
+            lambda: restrict_to_land(ds_CF, monthly=False, variable_name="S_hub"),
+            ds_CF,
+        )
+
+        print("analyze_generation histograms")
+        data_path = analyze_generation.data_path
+        ds_CF.to_netcdf(data_path + "IDL_SWT120_3600_1986_GRASS.nc")
+        results["analyze_generation_histograms"] = run_stage(
+            lambda: analyze_generation.construct_histogram_data(
+                "IDL", "GRASS", np.arange(0, 1.01, 0.05), years=[1986]
+            ),
+            ds_CF,
+        )
+    return results
+
+
+def save_results(results, n_days, grid_scale, path=benchmark_dir):
+    """
+    Store results together with metadata about the run as json
+    """
+    os.makedirs(path, exist_ok=True)
+    timestamp = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
+    output = {
+        "metadata": {
+            "timestamp": timestamp,
+            "n_days": n_days,
+            "grid_scale": grid_scale,
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "pandas": pd.__version__,
+            "xarray": xr.__version__,
+            "dask": dask.__version__,
+            "machine": platform.node(),
+        },
+        "stages": results,
+    }
+    filename = path + "benchmark_" + timestamp + ".json"
+    with open(filename, "w") as file:
+        json.dump(output, file, indent=2)
+    return filename
+
+
+def compare_benchmarks(reference_file, new_file, tolerance=0.2):
+    """
+    Compare two benchmark files and report stages that got slower or need more
+    memory by more than tolerance (relative)
+    :return: list of (stage, metric, reference value, new value)
+    """
+    with open(reference_file) as file:
+        reference = json.load(file)["stages"]
+    with open(new_file) as file:
+        new = json.load(file)["stages"]
+    regressions = []
+    for stage in set(reference) & set(new):
+        for metric in ["seconds", "peak_memory_MB"]:
+            if new[stage][metric] > (1 + tolerance) * reference[stage][metric]:
+                regressions.append(
+                    (stage, metric, reference[stage][metric], new[stage][metric])
+                )
+    for stage, metric, value_reference, value_new in regressions:
+        print(
+            "Regression in "
+            + stage
+            + ": "
+            + metric
+            + " "
+            + str(np.round(value_reference, 2))
+            + " -> "
+            + str(np.round(value_new, 2))
+        )
+    return regressions
+
+
+if __name__ == "__main__":
+    n_days, grid_scale = 7, 1
+    previous_files = sorted(glob.glob(benchmark_dir + "benchmark_*.json"))
+    results = run_benchmarks(n_days, grid_scale)
+    for stage, result in results.items():
+        print(
+            stage
+            + ": "
+            + str(np.round(result["seconds"], 2))
+            + " s, "
+            + str(int(result["MB_per_s"]))
+            + " MB/s, peak memory "
+            + str(int(result["peak_memory_MB"]))
+            + " MB"
+        )
+    filename = save_results(results, n_days, grid_scale)
+    if previous_files:
+        compare_benchmarks(previous_files[-1], filename)
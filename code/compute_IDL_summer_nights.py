@@ -1,6 +1,7 @@
 import xarray as xr
+from output_encoding import write_dataset
+from aggregation import Reducer, stream_archive
 
-data_dir = "../data/"
 target_dir = "../data/summernights_IDL/"
 
 
@@ -9,13 +10,41 @@ def select_summer_nights(ds):
     ds = ds.sel(time=ds["time.month"] == 7)
     return ds
 
-# Compute and save July midnight mean wind speeds
-for experiment in ["FOREST", "GRASS"]:
-    ds = xr.open_mfdataset(
-        data_dir + "IDL/" + experiment + "/S/*.nc", preprocess=select_summer_nights
-    )
-    ds = ds.mean(dim="time")
-    ds.load()
-    print("loaded")
-    ds.to_netcdf(ds.to_netcdf(target_dir + experiment + "/S_IDL_summernights.nc"))
 
+class SummerNightMeans(Reducer):
+    """
+    July midnight mean wind speeds (streaming, see aggregation.stream_archive)
+    """
+
+    def __init__(self):
+        self.sum = None
+        self.count = None
+        self.static = None  # variables without time dimension, e.g. rotated_pole
+
+    def update(self, ds):
+        ds = select_summer_nights(ds)
+        if ds.time.size == 0:
+            return
+        time_vars = [
+            var for var in ds.data_vars if "time" in ds[var].dims and var != "time_bnds"
+        ]
+        if self.sum is None:
+            self.static = ds.drop_vars(time_vars + ["time_bnds"], errors="ignore")
+            self.static = self.static.drop_dims("time", errors="ignore")
+            self.sum = ds[time_vars].sum(dim="time")
+            self.count = ds[time_vars].count(dim="time")
+        else:
+            self.sum += ds[time_vars].sum(dim="time")
+            self.count += ds[time_vars].count(dim="time")
+
+    def save(self, institution, experiment):
+        if self.sum is None:  # no July data
+            return
+        ds = xr.merge([self.static, self.sum / self.count])
+        write_dataset(ds, target_dir + experiment + "/S_IDL_summernights.nc", "map")
+
+
+if __name__ == "__main__":
+    # Compute and save July midnight mean wind speeds
+    for experiment in ["FOREST", "GRASS"]:
+        stream_archive("IDL", experiment, [SummerNightMeans()])
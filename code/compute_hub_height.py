@@ -5,63 +5,14 @@
 import xarray as xr
 from utils import *
 import numpy as np
-from multiprocessing import Pool
+from output_encoding import write_dataset
+from timeseries_store import build_store, hub_height_store
+from wind_data import open_wind_geopotential, select_levels, wind_filename
+from scheduler import Task, run_tasks
 
-data_dir = "../data/"
 output_dir = "../output/"
 
 
-def open_wind_geopotential(ins, year, experiment):
-    if ins == "GERICS":
-        ds_GERICS_FI = xr.open_dataset(
-            "../data/GERICS/" + experiment + "/FI_interpolated/FI_" + year + ".nc"
-        ).sel(lev=[26, 27])
-        ds_GERICS_FIB = xr.open_dataset(
-            "../data/GERICS/" + experiment + "/FIB/FIB_" + year + ".nc"
-        )
-        ds_GERICS_height = ds_GERICS_FI["FI"] - ds_GERICS_FIB["FIB"]
-
-        ds_wind = (
-            xr.open_dataset(data_dir + "GERICS/" + experiment + "/S/S_" + year + ".nc")
-            .sel(lev=[26, 27])
-            .drop(["rotated_pole", "hyai", "hybi", "hyam", "hybm"])
-        )
-        ds_wind["height"] = ds_GERICS_height
-    elif ins == "IDL":
-        mlevs = [0, 1]  # only using levels 0 and 1 corresponding to around 28m and 97m
-        ds_IDL_zg = xr.open_dataset(
-            "../data/IDL/"
-            + experiment
-            + "/zg/zg_EUR-44_ECMWF-ERAINT_LUCAS_"
-            + experiment
-            + "_r1i1p1_IDL_WRFV381D_v1_1hr_"
-            + year
-            + "010100-"
-            + year
-            + "123123.nc"
-        ).isel(mlev=mlevs)
-        ds_IDL_oro = xr.open_dataset(
-            "../data/IDL/orog_EUR-44_ECMWF-ERAINT_LUCAS_EVAL_r1i1p1_IDL_WRFV381D_v1_fx.nc"
-        )
-        ds_wind = (
-            xr.open_dataset(data_dir + "IDL/" + experiment + "/S/" + year + ".nc")
-            .isel(mlev=mlevs)
-            .drop(["rotated_pole", "time_bnds"])
-        )
-        # coordinates are off by a rounding error. Corrected here
-        for ds_tmp in [ds_IDL_zg, ds_IDL_oro, ds_wind]:
-            for rdim in ["rlat", "rlon"]:
-                ds_tmp[rdim] = np.round(ds_tmp[rdim], 2)
-        ds_IDL_height = ds_IDL_zg["zg"] - ds_IDL_oro["orog"].drop(["lon", "lat"])
-        ds_wind["height"] = ds_IDL_height
-        ds_wind = ds_wind.assign_coords(
-            {"mlev": ds_wind.mlev}
-        )  # mlev is not registered as a coordinate
-    else:
-        print("Only GERICS and IDL currently implemented")
-    return ds_wind
-
-
 def calculate_hub_height_xr(ds, institution, hub_height=90):
     """
     Calculates wind speeds at hub height using data at evolving heights and
@@ -98,6 +49,106 @@ def calculate_hub_height_xr(ds, institution, hub_height=90):
     return ds_hub
 
 
+def hub_height_kernel(s, z, hub_height=90):
+    """
+    Power law interpolation to hub height on plain numpy arrays. s (wind speeds) and
+    z (heights) contain two levels along the last axis. Lower and upper level are
+    picked per element, so alpha and the hub height wind are computed in one pass
+    without creating selected copies of the full fields.
+    Same result as calculate_hub_height_xr.
+
+    hub_height can also be a list of heights. The power law exponent is then computed
+    once and the wind speeds at all heights are returned along a new last axis.
+    """
+    s_0, s_1, z_0, z_1 = s[..., 0], s[..., 1], z[..., 0], z[..., 1]
+    first_is_min = z_0 <= z_1  # idxmin/idxmax return the first level on ties
+    first_is_max = z_0 >= z_1
+    s_min = np.where(first_is_min, s_0, s_1)
+    z_min = np.where(first_is_min, z_0, z_1)
+    alpha = np.log(np.where(first_is_max, s_0, s_1) / s_min) / np.log(
+        np.where(first_is_max, z_0, z_1) / z_min
+    )
+    if np.ndim(hub_height) == 0:
+        return s_min * (hub_height / z_min) ** alpha
+    hub_height = np.asarray(hub_height, dtype=float)
+    return s_min[..., None] * (hub_height / z_min[..., None]) ** alpha[..., None]
+
+
+def memory_per_timestep(ds, institution, n_hub_heights=1):
+    """
+    Memory (in bytes) needed to process one timestep. Accounts for wind speed and
+    height on both levels, temporaries of the kernel and the output at n_hub_heights
+    heights.
+    """
+    vertical_dim = vertical_dim_dic[institution]
+    # input levels, kernel temporaries and output
+    n_fields = 2 * ds[vertical_dim].size + 5 + n_hub_heights
+    bytes_per_step = ds["S"].isel(time=0, drop=True).size / ds[vertical_dim].size * 8
+    return n_fields * bytes_per_step
+
+
+def time_chunk_size(ds, institution, memory_budget, n_hub_heights=1):
+    """
+    Number of timesteps that can be processed at once within memory_budget (in bytes).
+    """
+    return max(
+        1, int(memory_budget / memory_per_timestep(ds, institution, n_hub_heights))
+    )
+
+
+def year_memory(institution, year, experiment, n_hub_heights=1):
+    """
+    Memory (in bytes) needed to process a whole year at once. Only the metadata of the
+    wind speed file is read, geopotential and static fields are not opened.
+    """
+    with xr.open_dataset(wind_filename(institution, year, experiment)) as ds:
+        ds = select_levels(ds, institution)
+        return ds.time.size * memory_per_timestep(ds, institution, n_hub_heights)
+
+
+def calculate_hub_height_chunked(ds, institution, hub_height=90, memory_budget=2e9):
+    """
+    Chunk-aware version of calculate_hub_height_xr. Data is processed lazily in
+    blocks of timesteps such that each block fits into memory_budget (in bytes),
+    ds therefore does not need to be loaded beforehand.
+
+    It is assumed that the Dataset ds only contains two levels that are close to the
+    hub height.
+
+    hub_height can be a single height or a list of heights (e.g. [80, 100, 120, 150]).
+    In the latter case, S_hub has an additional hub_height dimension.
+    """
+    vertical_dim = vertical_dim_dic[institution]
+    multiple_heights = np.ndim(hub_height) > 0
+    n_hub_heights = len(hub_height) if multiple_heights else 1
+    ds = ds.chunk(
+        {
+            "time": time_chunk_size(ds, institution, memory_budget, n_hub_heights),
+            vertical_dim: -1,
+        }
+    )
+    y_hub = xr.apply_ufunc(
+        hub_height_kernel,
+        ds["S"],
+        ds["height"],
+        input_core_dims=[[vertical_dim], [vertical_dim]],
+        output_core_dims=[["hub_height"]] if multiple_heights else [[]],
+        kwargs={"hub_height": hub_height},
+        dask="parallelized",
+        output_dtypes=[float],
+        dask_gufunc_kwargs=(
+            {"output_sizes": {"hub_height": n_hub_heights}} if multiple_heights else {}
+        ),
+    )
+    if multiple_heights:
+        y_hub = y_hub.assign_coords({"hub_height": list(hub_height)})
+        y_hub["hub_height"].attrs = {"units": "m"}
+        y_hub = y_hub.transpose("hub_height", ...)
+    ds_hub = y_hub.to_dataset(name="S_hub")
+    ds_hub["S_hub"].attrs = {"long_name": "Wind speed at hub height [m/s]"}
+    return ds_hub
+
+
 def plot_illustration_location(
     ds=None, ins="GERICS", year="2000", experiment="GRASS", z_hub=90
 ):
@@ -154,14 +205,50 @@ def plot_illustration_location(
 
 
 class Run_parallel:
-    def __init__(self, ins, experiment):
+    def __init__(self, ins, experiment, memory_budget=2e9, hub_height=90):
+        """
+        memory_budget: approximate memory per worker in bytes
+        hub_height: hub height or list of hub heights in m
+        """
         self.ins = ins
         self.experiment = experiment
+        self.memory_budget = memory_budget
+        self.hub_height = hub_height
 
-    def run_parallel(self, year):
-        ds_wind = open_wind_geopotential(self.ins, year, self.experiment).load()
-        ds_hub = calculate_hub_height_xr(ds_wind, self.ins)
-        ds_hub.to_netcdf(
+    def run_parallel(self, year, memory_budget=None):
+        """
+        memory_budget: overrides the memory budget of the instance (e.g. for retries
+        with smaller chunks, see scheduler.py)
+        """
+        ds_wind = open_wind_geopotential(self.ins, year, self.experiment)
+        ds_hub = calculate_hub_height_chunked(
+            ds_wind,
+            self.ins,
+            hub_height=self.hub_height,
+            memory_budget=memory_budget or self.memory_budget,
+        )
+        write_dataset(ds_hub, self.filename(year))
+
+    def full_memory(self, year):
+        """
+        Estimated memory (in bytes) to process the whole year at once
+        """
+        return year_memory(self.ins, year, self.experiment, np.size(self.hub_height))
+
+    def task(self, year):
+        """
+        Task for scheduler.run_tasks
+        """
+        return Task(
+            self.ins + " " + self.experiment + " " + year,
+            self.run_parallel,
+            (year,),
+            self.full_memory(year),
+            self.memory_budget,
+        )
+
+    def filename(self, year):
+        return (
             output_dir
             + "/hub_height_wind/S_hub_"
             + self.ins
@@ -174,9 +261,19 @@ class Run_parallel:
 
 
 if __name__ == "__main__":
-    for ins in ["GERICS", "IDL"]:
-        for experiment in ["GRASS", "FOREST"]:
-            run = Run_parallel(ins, experiment)
-            with Pool(30) as pool:
-                pool.map(run.run_parallel, [str(x) for x in np.arange(1986, 2016)])
+    runs = [
+        Run_parallel(ins, experiment)
+        for ins in ["GERICS", "IDL"]
+        for experiment in ["GRASS", "FOREST"]
+    ]
+    years = [str(x) for x in np.arange(1986, 2016)]
+    # all institutions, experiments and years in one queue, interleaved by year
+    run_tasks([run.task(year) for year in years for run in runs])
+    for run in runs:
+        # all years in one store for the analyses
+        build_store(
+            [run.filename(year) for year in years],
+            hub_height_store(run.ins, run.experiment),
+            years,
+        )
     plot_illustration_location()
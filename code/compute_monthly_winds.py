@@ -1,23 +1,136 @@
+import os
+import numpy as np
 import xarray as xr
 import pandas as pd
 from params import *
+from output_encoding import write_dataset
+from aggregation import Reducer, stream_archive, yearly_files
+from file_signature import source_signature
 
 data_dir = "../data/"
 target_dir = "../data/monthly/"
 
-for experiment in ["FOREST", "GRASS"]:
-    for institution in ["GERICS", "IDL"]:
-        print(institution)
-        ds = xr.open_mfdataset(data_dir + institution + "/" + experiment + "/S/*.nc")
-        if institution == "GERICS":
-            # time index needs modification to be understood by xarray
-            ds["time"] = pd.date_range(
-                start="19860101.", periods=ds.time.size, freq="6h"
-            )
-        # Resample to monthly values
-        ds = ds.resample(time="1MS").mean(dim="time").compute()
-        # use same lat-lon coordinates
+
+def compute_monthly_means(ds, institution):
+    """
+    Resample wind speeds to monthly means on the common lat-lon domain
+    """
+    if institution == "GERICS":
+        # time index needs modification to be understood by xarray
+        ds["time"] = pd.date_range(start="19860101.", periods=ds.time.size, freq="6h")
+    # Resample to monthly values
+    ds = ds.resample(time="1MS").mean(dim="time").compute()
+    # use same lat-lon coordinates
+    ds = ds.sel(
+        {"rlat": horizontal_ranges["rlats"], "rlon": horizontal_ranges["rlons"]}
+    )
+    return ds
+
+
+def partial_filename(institution, experiment, year):
+    return (
+        target_dir + experiment + "/partial/S_" + institution + "_" + str(year) + ".nc"
+    )
+
+
+def up_to_date_years(institution, experiment):
+    """
+    Years whose monthly sums exist and were computed from the current input file
+    """
+    years = []
+    for year, filename in yearly_files(institution, experiment):
+        partial = partial_filename(institution, experiment, year)
+        if os.path.exists(partial):
+            with xr.open_dataset(partial) as ds:
+                if ds.attrs.get("source") == source_signature(filename):
+                    years.append(year)
+    return years
+
+
+class MonthlyMeans(Reducer):
+    """
+    Streaming version of compute_monthly_means (see aggregation.stream_archive).
+    Monthly sums and counts are stored per year in target_dir/<experiment>/partial/,
+    so that new or changed years can be added without recomputing the others and
+    interrupted runs resume after the last finished year. The monthly means are
+    combined from the stored sums and counts in save.
+    """
+
+    def __init__(self, skip_years=()):
+        """
+        skip_years: years with up to date sums and counts (see up_to_date_years)
+        """
+        self.skip_years = set(skip_years)
+        self.sums = []  # monthly sums and counts of the current year
+
+    def update(self, ds):
+        if int(ds["time.year"][0]) in self.skip_years:
+            return
         ds = ds.sel(
             {"rlat": horizontal_ranges["rlats"], "rlon": horizontal_ranges["rlons"]}
         )
-        ds.to_netcdf(target_dir + experiment + "/S_" + institution + ".nc")
+        time_vars = [
+            var
+            for var in ds.data_vars
+            if "time" in ds[var].dims and np.issubdtype(ds[var].dtype, np.floating)
+        ]
+        monthly = ds[time_vars].resample(time="1MS")
+        sums = monthly.sum(dim="time").rename({var: var + "_sum" for var in time_vars})
+        counts = monthly.count(dim="time").rename(
+            {var: var + "_count" for var in time_vars}
+        )
+        # time_bnds is not needed for monthly means
+        static = ds.drop_vars(time_vars).drop_dims("time", errors="ignore")
+        self.sums.append(xr.merge([sums, counts, static]))
+
+    def end_year(self, institution, experiment, year, filename):
+        if year in self.skip_years or not self.sums:
+            return
+        ds = xr.concat(self.sums, dim="time", data_vars="minimal")
+        ds.attrs["source"] = source_signature(filename)
+        partial = partial_filename(institution, experiment, year)
+        os.makedirs(os.path.dirname(partial), exist_ok=True)
+        # write to a temporary file first, so that only complete years are stored
+        write_dataset(ds, partial + ".tmp", "lossless")
+        os.replace(partial + ".tmp", partial)
+        self.sums = []
+
+    def save(self, institution, experiment):
+        means = []
+        for year, _ in yearly_files(institution, experiment):
+            with xr.open_dataset(partial_filename(institution, experiment, year)) as ds:
+                sum_vars = [var for var in ds.data_vars if var.endswith("_sum")]
+                ds_mean = ds.drop_vars(
+                    sum_vars + [var[:-4] + "_count" for var in sum_vars]
+                )
+                for var in sum_vars:
+                    ds_mean[var[:-4]] = ds[var] / ds[var[:-4] + "_count"]
+                    ds_mean[var[:-4]].attrs = ds[var].attrs
+                ds_mean.attrs.pop("source")
+                means.append(ds_mean.load())
+        write_dataset(
+            xr.concat(means, dim="time", data_vars="minimal"),
+            target_dir + experiment + "/S_" + institution + ".nc",
+            "map",
+        )
+
+
+def update_monthly_means(institution, experiment):
+    """
+    Compute monthly sums and counts of new or changed years only and combine all years
+    to monthly means
+    """
+    skip_years = up_to_date_years(institution, experiment)
+    years = [
+        year
+        for year, _ in yearly_files(institution, experiment)
+        if year not in skip_years
+    ]
+    stream_archive(institution, experiment, [MonthlyMeans(skip_years)], years)
+
+
+if __name__ == "__main__":
+    for experiment in ["FOREST", "GRASS"]:
+        for institution in ["GERICS", "IDL"]:
+            print(institution)
+            update_monthly_means(institution, experiment)
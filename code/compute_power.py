@@ -1,7 +1,17 @@
 # Translate hub height wind speeds to capacity factor timeseries
 
 from utils_from_CESM2energy import *
-from multiprocessing import Pool
+import dask
+from power_curves import pool_kwargs
+from output_encoding import write_dataset
+from compute_hub_height import (
+    open_wind_geopotential,
+    calculate_hub_height_chunked,
+    output_dir,
+    year_memory,
+)
+from scheduler import Task, run_tasks
+from timeseries_store import build_store, hub_height_store, CF_store
 
 
 class CF_computation:
@@ -9,35 +19,79 @@ class CF_computation:
     Class to enable parallel execution of wind power conversion
     """
 
-    def __init__(self, ins, experiment):
+    def __init__(self, ins, experiment, memory_budget=2e9):
+        """
+        memory_budget: approximate memory per worker in bytes
+        """
         self.P = Power(
-            1
+            "SWT120_3600"
         )  # Instantiate turbine SWT120-3600 (i.e., the median turbine at 7m/s)
         self.ins = ins
         self.experiment = experiment
+        self.memory_budget = memory_budget
 
-    def compute_CF(self, year):
-        # Open hub height winds
-        ds_wind = xr.open_dataset(
-            (
-                "../output/hub_height_wind/S_hub_"
-                + self.ins
-                + "_"
-                + year
-                + "_"
-                + self.experiment
-                + ".nc"
-            )
+    def compute_CF(self, year, memory_budget=None):
+        """
+        memory_budget: overrides the memory budget of the instance (e.g. for retries
+        with smaller chunks, see scheduler.py)
+        """
+        # Open hub height winds in blocks of timesteps that fit into the memory budget
+        ds_wind = xr.open_dataset(self.hub_height_filename(year))
+        time_chunk = max(
+            1,
+            int(
+                (memory_budget or self.memory_budget)
+                / self.memory_per_timestep(ds_wind)
+            ),
         )
+        ds_wind = ds_wind.chunk({"time": time_chunk})
         # Convert to capacity factor
-        wind_power = xr.apply_ufunc(
-            self.P.power_conversion,
-            ds_wind["S_hub"],
-            vectorize=True,
-            dask="allowed",
-        ).to_dataset()
+        wind_power = self.P.convert(ds_wind["S_hub"]).to_dataset()
         # Save
-        wind_power.to_netcdf(
+        write_dataset(
+            wind_power, self.CF_filename(year), packing={"S_hub": "capacity_factor"}
+        )
+
+    def memory_per_timestep(self, ds_wind):
+        """
+        Memory (in bytes) needed per timestep for the wind speeds, the capacity factors
+        and temporaries of the conversion
+        """
+        return 3 * ds_wind["S_hub"].isel(time=0, drop=True).size * 8
+
+    def full_memory(self, year):
+        """
+        Estimated memory (in bytes) to process the whole year at once
+        """
+        with xr.open_dataset(self.hub_height_filename(year)) as ds_wind:
+            return ds_wind.time.size * self.memory_per_timestep(ds_wind)
+
+    def task(self, year):
+        """
+        Task for scheduler.run_tasks
+        """
+        return Task(
+            self.ins + " " + self.experiment + " " + year,
+            self.compute_CF,
+            (year,),
+            self.full_memory(year),
+            self.memory_budget,
+        )
+
+    def hub_height_filename(self, year):
+        return (
+            output_dir
+            + "/hub_height_wind/S_hub_"
+            + self.ins
+            + "_"
+            + year
+            + "_"
+            + self.experiment
+            + ".nc"
+        )
+
+    def CF_filename(self, year):
+        return (
             "../output/generation/"
             + self.ins
             + "_"
@@ -50,16 +104,81 @@ class CF_computation:
         )
 
 
-def run_parallel():
+class Fused_CF_computation(CF_computation):
+    """
+    Streaming version of compute_hub_height.Run_parallel followed by CF_computation.
+    Wind speeds and geopotential are processed in blocks of timesteps that fit into
+    memory_budget (in bytes) and converted to hub height winds and capacity factors
+    in memory, so that the hub height winds do not need to be written to and read
+    back from disk.
+    """
+
+    def __init__(self, ins, experiment, memory_budget=2e9, save_hub_height=False):
+        super().__init__(ins, experiment, memory_budget)
+        self.save_hub_height = save_hub_height
+
+    def compute_CF(self, year, memory_budget=None):
+        ds_wind = open_wind_geopotential(self.ins, year, self.experiment)
+        ds_hub = calculate_hub_height_chunked(
+            ds_wind, self.ins, memory_budget=memory_budget or self.memory_budget
+        )
+        wind_power = self.P.convert(ds_hub["S_hub"]).to_dataset()
+        writes = [
+            write_dataset(
+                wind_power,
+                self.CF_filename(year),
+                packing={"S_hub": "capacity_factor"},
+                compute=False,
+            )
+        ]
+        if self.save_hub_height:
+            writes.append(
+                write_dataset(ds_hub, self.hub_height_filename(year), compute=False)
+            )
+        dask.compute(*writes)  # both outputs are computed in a single pass
+
+    def full_memory(self, year):
+        # hub height winds and capacity factors as output
+        return year_memory(self.ins, year, self.experiment, n_hub_heights=2)
+
+
+def run_parallel(fused=False, save_hub_height=False):
     """
-    Loop over institutions and experiments and compute capacity factor for 30y in parallel
+    Compute capacity factors for 30y of all institutions and experiments in parallel,
+    scheduled according to the available memory and cores (see scheduler.py)
+
+    fused: if True, capacity factors are computed directly from the wind speeds and
+    geopotential without the intermediate hub height files from compute_hub_height.py
+    save_hub_height: only used if fused, additionally save the hub height winds
     """
+    CFs = []
     for ins in ["GERICS", "IDL"]:
         for experiment in ["GRASS", "FOREST"]:
-            print(ins + " " + experiment)
-            CF = CF_computation(ins, experiment)
-            with Pool(30) as pool:  # 1 worker per year
-                pool.map(CF.compute_CF, [str(x) for x in np.arange(1986, 2016)])
+            if fused:
+                CFs.append(
+                    Fused_CF_computation(
+                        ins, experiment, save_hub_height=save_hub_height
+                    )
+                )
+            else:
+                CFs.append(CF_computation(ins, experiment))
+    years = [str(x) for x in np.arange(1986, 2016)]
+    # all institutions, experiments and years in one queue, interleaved by year
+    run_tasks([CF.task(year) for year in years for CF in CFs], **pool_kwargs())
+    for CF in CFs:
+        # all years in one store for the analyses
+        build_store(
+            [CF.CF_filename(year) for year in years],
+            CF_store(CF.ins, CF.experiment, CF.P.turbine_name),
+            years,
+            packing={"S_hub": "capacity_factor"},
+        )
+        if fused and save_hub_height:
+            build_store(
+                [CF.hub_height_filename(year) for year in years],
+                hub_height_store(CF.ins, CF.experiment),
+                years,
+            )
 
 
 if __name__ == "__main__":
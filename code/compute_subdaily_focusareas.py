@@ -1,8 +1,8 @@
 import xarray as xr
 from utils import *
-import pandas as pd
+from output_encoding import write_dataset
+from aggregation import Reducer, stream_archive
 
-data_dir = "../data/"
 target_dir = "../data/sub-daily/"
 
 
@@ -29,33 +29,51 @@ def select_month(ds, month):
     return ds.sel(time=ds["time.month"] == month)
 
 
-for experiment in ["FOREST", "GRASS"]:
-    for institution in [
-        "GERICS",
-        "IDL",
-    ]:
-        print(institution)
-        ds = xr.open_mfdataset(data_dir + institution + "/" + experiment + "/S/*.nc")
-        if institution == "GERICS":
-            # time index needs modification to be understood by xarray
-            ds["time"] = pd.date_range(
-                start="19860101.", periods=ds.time.size, freq="6h"
-            )
+class FocusAreaSeries(Reducer):
+    """
+    Wind speeds at 0, 6, 12 and 18h averaged over the focus areas for selected months
+    (streaming, see aggregation.stream_archive)
+    """
+
+    def __init__(
+        self, months=[1, 4, 7, 10], focus_areas=["Germany", "Sweden", "Spain"]
+    ):
+        self.months = months
+        self.focus_areas = focus_areas
+        self.series = {
+            (month, focus_area): [] for month in months for focus_area in focus_areas
+        }
+
+    def update(self, ds):
+        month = int(ds["time.month"][0])
+        if month not in self.months:
+            return
         ds = select_common_hours(ds)
-        for month in [1, 4, 7, 10]:
-            ds_month = select_month(ds, month).load()
-            print("monthly data loaded")
-            for focus_area in ["Germany", "Sweden", "Spain"]:
-                print(focus_area)
-                ds_focus = get_focus_area(ds_month, area_name=focus_area)
-                ds_focus.to_netcdf(
-                    target_dir
-                    + experiment
-                    + "/S_"
-                    + institution
-                    + "_subdaily_"
-                    + focus_area
-                    + "_month_"
-                    + str(month)
-                    + ".nc"
-                )
+        for focus_area in self.focus_areas:
+            self.series[(month, focus_area)].append(
+                get_focus_area(ds, area_name=focus_area)
+            )
+
+    def save(self, institution, experiment):
+        for (month, focus_area), series in self.series.items():
+            if not series:  # month not contained in the data
+                continue
+            write_dataset(
+                xr.concat(series, dim="time", data_vars="minimal"),
+                target_dir
+                + experiment
+                + "/S_"
+                + institution
+                + "_subdaily_"
+                + focus_area
+                + "_month_"
+                + str(month)
+                + ".nc",
+            )
+
+
+if __name__ == "__main__":
+    for experiment in ["FOREST", "GRASS"]:
+        for institution in ["GERICS", "IDL"]:
+            print(institution)
+            stream_archive(institution, experiment, [FocusAreaSeries()])
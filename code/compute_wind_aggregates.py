@@ -0,0 +1,20 @@
+# Monthly means, sub-daily focus areas and July midnight means (IDL) in one pass over
+# the wind speed archive. Produces the same output as running
+# compute_monthly_winds.py, compute_subdaily_focusareas.py and
+# compute_IDL_summer_nights.py one after another, but reads every file only once.
+
+from aggregation import stream_archive
+from compute_monthly_winds import MonthlyMeans, up_to_date_years
+from compute_subdaily_focusareas import FocusAreaSeries
+from compute_IDL_summer_nights import SummerNightMeans
+
+if __name__ == "__main__":
+    for experiment in ["FOREST", "GRASS"]:
+        for institution in ["GERICS", "IDL"]:
+            reducers = [
+                MonthlyMeans(up_to_date_years(institution, experiment)),
+                FocusAreaSeries(),
+            ]
+            if institution == "IDL":
+                reducers.append(SummerNightMeans())
+            stream_archive(institution, experiment, reducers)
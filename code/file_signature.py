@@ -0,0 +1,12 @@
+# Signatures of input files, used to detect changed inputs without reading them
+# (time series stores, cached static fields, result cache, monthly aggregates).
+
+import os
+
+
+def source_signature(filename):
+    """
+    Size and modification time of a file, used to detect changed input files
+    """
+    stat = os.stat(filename)
+    return str(stat.st_size) + "_" + str(stat.st_mtime_ns)
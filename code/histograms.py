@@ -0,0 +1,106 @@
+# Histograms with fixed uniform bins, accumulated chunk by chunk.
+# Bin indices are computed arithmetically from the bin width (with the same edge
+# corrections as np.histogram, so that counts are identical) and counted with
+# np.bincount. The chunks of lazily opened (dask) arrays are processed in parallel,
+# and all bin sets and groups of timesteps (e.g. seasons) are counted from a single
+# read of each chunk.
+
+import dask
+import dask.array
+import numpy as np
+
+
+def check_uniform(bins):
+    """
+    Bin edges as float array, raises ValueError if the bins are not uniform
+    """
+    bins = np.asarray(bins, dtype=float)
+    widths = np.diff(bins)
+    if bins.size < 2 or not np.allclose(widths, widths[0], rtol=1e-6, atol=0):
+        raise ValueError("Bins must be uniform and increasing")
+    return bins
+
+
+def bin_counts(values, bins):
+    """
+    Same as np.histogram(values[np.isfinite(values)], bins)[0] for uniform bins
+    """
+    values = np.asarray(values).ravel()
+    n_bins = bins.size - 1
+    first, last = bins[0], bins[-1]
+    values = values[(values >= first) & (values <= last)]  # also excludes NaN
+    idx = ((values - first) * (n_bins / (last - first))).astype(np.intp)
+    idx[idx == n_bins] -= 1  # the last bin is closed
+    # correct rounding errors close to the edges
+    idx[values < bins[idx]] -= 1
+    idx[(values >= bins[idx + 1]) & (idx != n_bins - 1)] += 1
+    return np.bincount(idx, minlength=n_bins)
+
+
+def _block_counts(block, mask, labels, bin_sets):
+    """
+    Counts of one chunk (time first) for all bin sets, for all timesteps (group None)
+    and per group label
+    """
+    block = np.asarray(block)
+    if mask is not None:
+        values = block[:, mask]
+    else:
+        values = block.reshape(block.shape[0], -1)
+    groups = [(None, values)]
+    if labels is not None:
+        groups += [(label, values[labels == label]) for label in np.unique(labels)]
+    return {
+        (bins_name, group): bin_counts(group_values, bins)
+        for bins_name, bins in bin_sets.items()
+        for group, group_values in groups
+    }
+
+
+def histograms(sources, bin_sets, masks=None, group_labels=None):
+    """
+    Histograms of several (lazily opened) arrays, computed in parallel over their chunks
+    :param sources: dictionary name -> xr.DataArray with time as first dimension
+    :param bin_sets: dictionary name -> uniform bin edges
+    :param masks: dictionary name -> boolean DataArray (rlat, rlon) of the cells to
+        include (e.g. utils.LandSeaMask.mask), sources need dimensions (time, rlat,
+        rlon). Defaults to all cells.
+    :param group_labels: dictionary name -> label per timestep (e.g. season), counts
+        are additionally returned per label
+    :return: dictionary (source name, bin set name, group) -> counts, group is None
+        for all timesteps
+    """
+    bin_sets = {name: check_uniform(bins) for name, bins in bin_sets.items()}
+    masks = masks or {}
+    group_labels = group_labels or {}
+    names, tasks = [], []
+    for name, da in sources.items():
+        mask = masks.get(name)
+        if mask is not None:
+            mask = mask.transpose("rlat", "rlon").values
+            da = da.transpose("time", "rlat", "rlon")
+        data = dask.array.asarray(da.data)
+        labels = group_labels.get(name)
+        offsets = [np.cumsum((0,) + chunks) for chunks in data.chunks]
+        for index, block in np.ndenumerate(data.to_delayed()):
+            block_mask = None
+            if mask is not None:
+                block_mask = mask[
+                    offsets[1][index[1]] : offsets[1][index[1] + 1],
+                    offsets[2][index[2]] : offsets[2][index[2] + 1],
+                ]
+            block_labels = None
+            if labels is not None:
+                block_labels = np.asarray(labels)[
+                    offsets[0][index[0]] : offsets[0][index[0] + 1]
+                ]
+            names.append(name)
+            tasks.append(
+                dask.delayed(_block_counts)(block, block_mask, block_labels, bin_sets)
+            )
+    counts = {}
+    for name, block_counts in zip(names, dask.compute(*tasks)):
+        for (bins_name, group), n in block_counts.items():
+            key = (name, bins_name, group)
+            counts[key] = counts.get(key, 0) + n
+    return counts
@@ -1,26 +1,31 @@
 # Overview and sequencing of scripts
+# The scripts are executed by run_pipeline.py, which skips steps whose outputs are up to date,
+# runs independent steps in parallel and resumes after interruptions. The order is:
 
 ###############
 # Preprocessing
 ###############
-bash preprocess_GERICS.sh
-python preprocess_GERICS.py
-bash preprocess_IDL.sh
-python preprocess_IDL.py
+# python preprocess_GERICS.py
+# bash preprocess_IDL.sh
+# python preprocess_IDL.py
 
 ###############
 # Computation
 ###############
-python compute_approximate_heights.py  # Approximate  heights per model level
-python compute_monthly_winds.py  # monthly aggregates
-python compute_sub-daily_focusareas.py  # sub-daily in focus areas
-python compute_hub_height.py  # hub height winds
-python compute_power.py  # power generation
+# python compute_approximate_heights.py  # Approximate  heights per model level
+# python compute_wind_aggregates.py  # in one pass over the wind speeds:
+#   monthly aggregates (compute_monthly_winds.py)
+#   sub-daily in focus areas (compute_subdaily_focusareas.py)
+#   July midnight means in IDL (compute_IDL_summer_nights.py)
+# python compute_hub_height.py  # hub height winds
+# python compute_power.py  # power generation
 
 ###############
 # Analysis / Plotting
 ###############
-python analyze_monthly_means.py  # Mean wind changes
-python analyze_subdaily.py  # Daily cycle
-python analyze_summernights_IDL.py  # Summernights / Jet in IDL
-python analyze_generation.py  # power generation
\ No newline at end of file
+# python analyze_monthly_means.py  # Mean wind changes
+# python analyze_subdaily.py  # Daily cycle
+# python analyze_summernights_IDL.py  # Summernights / Jet in IDL
+# python analyze_generation.py  # power generation
+
+python run_pipeline.py "$@"
@@ -0,0 +1,176 @@
+# Streaming statistics of GRASS and FOREST wind speeds.
+# Count, mean and sum of squared deviations (M2) are accumulated per grid cell and
+# level with Welford's method in a single pass over time, separately for the whole
+# year and for each season. Means, differences, variances, onshore/offshore averages
+# and threshold fractions are then answered from the accumulated moments without
+# going through the data again. Accumulators of different time periods (e.g. from
+# parallel workers) can be merged.
+
+import xarray as xr
+from utils import crop_to_land_sea_mask, get_land_sea_mask
+
+SEASONS = ["DJF", "MAM", "JJA", "SON"]
+
+
+class OnlineMoments:
+    """
+    Count, mean and M2 of a DataArray along time, updated batch-wise
+    (Chan et al. parallel variant of Welford's algorithm). NaNs are ignored.
+    """
+
+    def __init__(self):
+        self.count = None
+        self.mean = None  # 0 where count is 0
+        self.M2 = None
+
+    def update(self, da):
+        """
+        Add all timesteps of da
+        """
+        count = da.count(dim="time")
+        mean = da.mean(dim="time").fillna(0)
+        M2 = ((da - mean) ** 2).sum(dim="time")
+        self._combine(count, mean, M2)
+
+    def merge(self, other):
+        """
+        Add the timesteps accumulated in other
+        """
+        if other.count is not None:
+            self._combine(other.count, other.mean, other.M2)
+        return self
+
+    def _combine(self, count, mean, M2):
+        if self.count is None:
+            self.count, self.mean, self.M2 = count, mean, M2
+            return
+        total = self.count + count
+        weight = (count / total).fillna(0)
+        delta = mean - self.mean
+        self.mean = self.mean + delta * weight
+        self.M2 = self.M2 + M2 + delta**2 * self.count * weight
+        self.count = total
+
+    def get_mean(self):
+        return self.mean.where(self.count > 0)
+
+    def get_variance(self, ddof=1):
+        return (self.M2 / (self.count - ddof)).where(self.count > ddof)
+
+
+def _pool(count, mean, M2, dims):
+    """
+    Combine per-cell moments to moments of all cells along dims
+    """
+    total = count.sum(dim=dims)
+    pooled_mean = (count * mean).sum(dim=dims) / total
+    pooled_M2 = (M2 + count * (mean - pooled_mean) ** 2).sum(dim=dims)
+    return total, pooled_mean, pooled_M2
+
+
+class ChangeStatistics:
+    """
+    Online moments of one variable for each experiment, year-round (season None)
+    and per season.
+    """
+
+    def __init__(self, experiments=["GRASS", "FOREST"], variable="S"):
+        self.experiments = experiments
+        self.variable = variable
+        self.moments = {
+            (experiment, season): OnlineMoments()
+            for experiment in experiments
+            for season in [None] + SEASONS
+        }
+
+    def update(self, ds, experiment):
+        """
+        Add a block of timesteps of one experiment
+        """
+        da = ds[self.variable]
+        self.moments[(experiment, None)].update(da)
+        for season, da_season in da.groupby("time.season"):
+            self.moments[(experiment, season)].update(da_season)
+
+    def merge(self, other):
+        """
+        Add the statistics accumulated in other (e.g. by another worker)
+        """
+        for key, moments in other.moments.items():
+            self.moments[key].merge(moments)
+        return self
+
+    def mean(self, experiment, season=None):
+        return self.moments[(experiment, season)].get_mean()
+
+    def variance(self, experiment, season=None, ddof=1):
+        return self.moments[(experiment, season)].get_variance(ddof)
+
+    def difference(self, season=None):
+        """
+        Difference of the time means GRASS - FOREST
+        """
+        return self.mean("GRASS", season) - self.mean("FOREST", season)
+
+    def land_mask(self, monthly=True):
+        """
+        True for onshore and False for offshore cells of the domain of interest
+        (see utils.get_land_sea_mask)
+        """
+        count = crop_to_land_sea_mask(self.moments[(self.experiments[0], None)].count)
+        return get_land_sea_mask(count, monthly).mask
+
+    def _region(self, da, region, monthly):
+        land_mask = self.land_mask(monthly)
+        da, land_mask = xr.align(da, land_mask, join="inner")
+        if region == "onshore":
+            return da.where(land_mask)
+        elif region == "offshore":
+            return da.where(~land_mask)
+        return da
+
+    def region_moments(self, experiment, season=None, region="onshore", monthly=True):
+        """
+        Count, mean and variance of all values (time and cells) in region, per level
+        :param region: "onshore", "offshore" or None (whole domain of interest)
+        """
+        moments = self.moments[(experiment, season)]
+        count, mean, M2 = [
+            self._region(da, region, monthly).fillna(0)
+            for da in [moments.count, moments.mean, moments.M2]
+        ]
+        count, mean, M2 = _pool(count, mean, M2, ["rlat", "rlon"])
+        return count, mean, M2 / (count - 1)
+
+    def region_mean(self, experiment, season=None, region="onshore", monthly=True):
+        return self.region_moments(experiment, season, region, monthly)[1]
+
+    def threshold_fraction(self, threshold, season=None, monthly=True):
+        """
+        Percentage of onshore cells (with data) whose mean change exceeds threshold
+        """
+        diff_land = self._region(self.difference(season), "onshore", monthly)
+        return (
+            (diff_land > threshold).sum(dim=["rlat", "rlon"])
+            / diff_land.count(dim=["rlat", "rlon"])
+            * 100
+        )
+
+
+def change_statistics(s_dict, time_chunk=12):
+    """
+    Accumulate ChangeStatistics per institution in blocks of time_chunk timesteps
+    :param s_dict: dictionary institution -> dataset with experiment dimension
+        (see analyze_monthly_means.load_monthly_data_dictionary)
+    :return: dictionary institution -> ChangeStatistics
+    """
+    stats = {}
+    for ins, ds in s_dict.items():
+        stats[ins] = ChangeStatistics(list(ds.experiment.values))
+        for experiment in stats[ins].experiments:
+            ds_experiment = ds.sel(experiment=experiment, drop=True)
+            for t in range(0, ds_experiment.time.size, time_chunk):
+                stats[ins].update(
+                    ds_experiment.isel(time=slice(t, t + time_chunk)), experiment
+                )
+    return stats
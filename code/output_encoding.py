@@ -0,0 +1,160 @@
+# Output encoding profiles used by all scripts that write NetCDF (or Zarr) files.
+# A profile defines the chunk shapes on disk (matching how later steps read the
+# files), the compression and whether variables are packed to smaller data types.
+# Variables with time dimension are written as float32 by default, which keeps
+# intermediate products (e.g. S, S_hub) that later steps read back in exact to float32
+# precision. Packing to scaled int16 is only applied where requested explicitly via
+# packing (final products such as the capacity factors). Variables without time
+# dimension (coordinates, rotated pole, hybrid coefficients) are written as they are.
+# Zarr stores are compressed with the default compressor of zarr, the compression
+# settings only apply to NetCDF files.
+
+import numpy as np
+
+# dimensions that are chunked with size 1 (one level / turbine per chunk)
+layer_dims = ["lev", "lev_2", "mlev", "plev", "pressure", "hub_height", "turbine"]
+# dimensions that are tiled in the time_series profile
+spatial_dims = ["rlat", "rlon", "rlat_2", "rlon_2", "lat", "lon"]
+
+PROFILES = {
+    # reading long time series of (small) regions, e.g. temporal means, histograms,
+    # focus areas
+    "time_series": {
+        "chunks": {
+            "time": 744,
+            **{dim: 1 for dim in layer_dims},
+            **{dim: 24 for dim in spatial_dims},
+        },
+        "compression": "zlib",
+        "complevel": 4,
+        "pack": True,
+    },
+    # reading full maps of single timesteps, e.g. monthly maps
+    "map": {
+        "chunks": {"time": 1, **{dim: 1 for dim in layer_dims}},
+        "compression": "zlib",
+        "complevel": 4,
+        "pack": True,
+    },
+    # consolidated multi-year stores (see timeseries_store.py)
+    "store": {
+        "chunks": {
+            "time": 2190,
+            **{dim: 1 for dim in layer_dims},
+            **{dim: 24 for dim in spatial_dims},
+        },
+        "compression": "zlib",
+        "complevel": 4,
+        "pack": True,
+    },
+    # same layout as time_series without conversion to float32 or packing
+    "lossless": {
+        "chunks": {
+            "time": 744,
+            **{dim: 1 for dim in layer_dims},
+            **{dim: 24 for dim in spatial_dims},
+        },
+        "compression": "zlib",
+        "complevel": 4,
+        "pack": False,
+    },
+}
+
+
+def _int16_packing(valid_min, valid_max):
+    """
+    Scaled int16 covering [valid_min, valid_max]. The smallest int16 value is the fill
+    value, so valid_min is stored as -32767.
+    """
+    scale_factor = (valid_max - valid_min) / (2 * 32767)
+    return {
+        "dtype": "int16",
+        "scale_factor": scale_factor,
+        "add_offset": valid_min + 32767 * scale_factor,
+        "_FillValue": np.int16(-32768),
+    }
+
+
+PACKINGS = {
+    "wind_speed": _int16_packing(0.0, 131.07),  # 0.002 m/s resolution
+    "capacity_factor": _int16_packing(0.0, 1.0),  # 1.5e-5 resolution
+    "float32": {"dtype": "float32"},
+    None: {},
+}
+
+# packing used if not specified otherwise when writing, int16 packing is opt-in
+DEFAULT_PACKING = {}
+
+
+def _chunk_sizes(da, chunks):
+    return tuple(min(chunks.get(dim, size), size) for dim, size in da.sizes.items())
+
+
+def encoding(ds, profile="time_series", packing=None, compression=None, zarr=False):
+    """
+    Encoding for all data variables with time dimension in ds
+    :param ds: xr.Dataset
+    :param profile: name of the profile in PROFILES
+    :param packing: dictionary variable name -> name in PACKINGS, overrides
+        DEFAULT_PACKING (e.g. {"S_hub": "capacity_factor"} for capacity factors stored
+        under the name of the wind speeds). Variables that are not listed are written
+        as float32.
+    :param compression: "zlib" or "zstd", defaults to the compression of the profile.
+        Only for NetCDF, raises ValueError if given with zarr=True.
+    :param zarr: if True, return an encoding for to_zarr (compressed with the default
+        compressor of zarr)
+    :return: dictionary that can be passed to to_netcdf or to_zarr
+    """
+    if zarr and compression is not None:
+        raise ValueError("compression is not supported for Zarr stores")
+    settings = PROFILES[profile]
+    packings = {**DEFAULT_PACKING, **(packing or {})}
+    compression = compression or settings["compression"]
+    encodings = {}
+    for var in ds.data_vars:
+        da = ds[var]
+        if "time" not in da.dims or not np.issubdtype(da.dtype, np.floating):
+            continue
+        var_encoding = {}
+        if settings["pack"]:
+            var_encoding.update(PACKINGS[packings.get(var, "float32")])
+        chunk_sizes = _chunk_sizes(da, settings["chunks"])
+        if zarr:
+            var_encoding["chunks"] = chunk_sizes
+        else:
+            var_encoding["chunksizes"] = chunk_sizes
+            if compression == "zlib":
+                var_encoding.update({"zlib": True, "shuffle": True})
+            else:
+                var_encoding["compression"] = compression
+            var_encoding["complevel"] = settings["complevel"]
+        encodings[var] = var_encoding
+    return encodings
+
+
+def write_dataset(
+    ds, filename, profile="time_series", packing=None, compression=None, compute=True
+):
+    """
+    Write ds with the encoding of profile. Filenames ending with .zarr are written as
+    Zarr stores, all others as NetCDF.
+    :param packing: see encoding, e.g. {"S_hub": "capacity_factor"} for final capacity
+        factors. Without packing, variables with time dimension are written as float32.
+    :param compression: see encoding, only for NetCDF
+    :param compute: if False, return a dask delayed object instead of writing
+    """
+    if filename.endswith(".zarr"):
+        encodings = encoding(ds, profile, packing, compression, zarr=True)
+        # dask chunks need to match the chunks on disk
+        ds = ds.chunk(
+            {
+                dim: min(PROFILES[profile]["chunks"].get(dim, size), size)
+                for dim, size in ds.sizes.items()
+            }
+        )
+        for var in ds.variables:
+            ds[var].encoding.pop("chunks", None)
+            ds[var].encoding.pop("preferred_chunks", None)
+        return ds.to_zarr(filename, mode="w", encoding=encodings, compute=compute)
+    encodings = encoding(ds, profile, packing, compression)
+    return ds.to_netcdf(filename, encoding=encodings, compute=compute)
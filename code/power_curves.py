@@ -0,0 +1,97 @@
+# Registry of wind turbine power curves.
+# The pickled power curves in ../output/*.p are read once per process, keyed by
+# turbine name and compiled into contiguous float arrays that the conversion
+# functions in utils_from_CESM2energy work on directly. Worker processes receive
+# the compiled curves via init_worker instead of re-reading the pickles.
+
+import glob
+import numpy as np
+import pandas as pd
+
+curve_path = "../output/"
+
+_registry = {}  # turbine name -> PowerCurve, filled by load_power_curves
+_file_order = []  # turbine names in sorted file order, used for index based access
+
+
+class PowerCurve:
+    """
+    Compiled power curve of a single turbine.
+
+    speeds: wind speeds of the lookup table [m/s], monotonically increasing
+    power: capacity factors at these wind speeds
+    cut_in, cut_out: first and last wind speed of the lookup table
+    curve: the original pandas DataFrame (used by the scalar conversion)
+    """
+
+    def __init__(self, name, curve):
+        self.name = name
+        self.curve = curve
+        self.speeds = np.ascontiguousarray(curve.index.values, dtype=float)
+        self.power = np.ascontiguousarray(curve.iloc[:, 0].values, dtype=float)
+        self.cut_in = self.speeds[0]
+        self.cut_out = self.speeds[-1]
+
+
+def load_power_curves(path=None, reload=False):
+    """
+    Load all power curves in path (default: ../output/) into the registry.
+    Curves are only read from disk the first time this function is called.
+    :param path: directory containing the pickled power curves
+    :param reload: if True, the pickles are read again
+    :return: dictionary turbine name -> PowerCurve
+    """
+    if _registry and not reload:
+        return _registry
+    if path is None:
+        path = curve_path
+    _registry.clear()
+    del _file_order[:]
+    for filename in sorted(glob.glob(path + "*.p")):
+        curve = pd.read_pickle(filename)
+        name = curve.keys()[0].replace("/", "_")  # / leads to issues when saving
+        _registry[name] = PowerCurve(name, curve)
+        _file_order.append(name)
+    return _registry
+
+
+def get_power_curve(turbine):
+    """
+    Return the compiled power curve of a turbine.
+    :param turbine: turbine name (e.g. "SWT120_3600") or index in sorted file order
+    :return: PowerCurve
+    """
+    load_power_curves()
+    if isinstance(turbine, (int, np.integer)):
+        turbine = _file_order[turbine]
+    return _registry[turbine]
+
+
+def turbine_names():
+    """
+    Names of all available turbines in sorted file order
+    """
+    load_power_curves()
+    return list(_file_order)
+
+
+def init_worker(registry, file_order):
+    """
+    Initializer for worker pools so that workers use the already compiled curves
+    """
+    _registry.clear()
+    _registry.update(registry)
+    _file_order[:] = file_order
+
+
+def pool_kwargs():
+    """
+    Keyword arguments for multiprocessing.Pool that hand the compiled power curves to
+    the workers, e.g. Pool(30, **pool_kwargs()) or scheduler.run_tasks(tasks,
+    **pool_kwargs())
+    """
+    load_power_curves()
+    return {
+        "initializer": init_worker,
+        "initargs": (dict(_registry), list(_file_order)),
+    }
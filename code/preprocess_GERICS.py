@@ -2,63 +2,279 @@
 # rlat (V uses rlat_2), rlon (U uses rlon_2), and vertical  (FI uses lev_2)
 # dimension as discussion in github issue #9 and prototype in
 #       notebooks/03_GERICS_grid_offsets.ipynb
-# Execution of this script requires prior execution of preprocess_GERICS.sh
+#
+# The raw model output (one file per timestep with all variables, stored in
+# <experiment>/raw_data/) is first split into yearly files per variable. Manual step
+# required before executing this script: rename experiments following
+#   "grass": "062008",
+#   "forest": "062009",
+#   "eval": "062010"
 
+import glob
+import os
+import time
+from functools import partial
+import dask
+import numpy as np
 import xarray as xr
+from multiprocessing import Pool
 from params import *
+from output_encoding import write_dataset
 
 data_path = "../data/GERICS/"
 
-######################
-# Combine ground geopotential (FIB) with upper levels (FI) and interpolate from lev_2 to lev
-######################
-for year in range(1986, 2016):
-    print(year)
-    for experiment in EXPERIMENTS:
-        # Load geopotential and drop non-needed variables
-        ds = xr.open_dataset(data_path + experiment + "/FI/FI_" + str(year) + ".nc")
-        ds = ds.drop(["hyai", "hybi", "hyam", "hybm"])
-        # Load surface geopotential and assign lev_2 coordinate (counted from top of atmoshere down)
-        ds_ground = xr.open_dataset(
-            data_path + experiment + "/FIB/FIB_" + str(year) + ".nc"
-        )  # Geopotential at surface
-        ds_ground = ds_ground.assign_coords({"lev_2": 28.0}).rename(
-            {"FIB": "FI"}
-        )  # ground is lowermost level
-        # Combine surface and further up
-        ds_combined = xr.concat([ds, ds_ground], dim="lev_2")
-        # Perform rolling mean interpolation (lev is defined between lev_2)
-        ds_combined = ds_combined.rolling({"lev_2": 2}).mean().dropna("lev_2")
-        # Rename variable from lev_2 to lev and align counting with other datasets
-        ds_combined = ds_combined.rename({"lev_2": "lev"}).assign_coords(
-            {"lev": [float(x) for x in range(1, 28)]}
-        )
-        # save
-        ds_combined.to_netcdf(
-            data_path + experiment + "/FI_interpolated/FI_" + str(year) + ".nc"
+# Variables and levels that are split from the raw output, only those used later on:
+# wind components and geopotential on the lowest levels (lev 22-27, approximately
+# 30-1300 m, see approximate_heights.yaml). FI on lev_2 22-27 and the surface
+# geopotential FIB give the geopotential on lev 22-27.
+raw_variables = ["FIB", "U", "V", "FI"]
+raw_levels = [float(x) for x in range(22, 28)]
+
+
+def split_raw_data(year, experiment, variables=raw_variables, levels=None):
+    """
+    Combine all timesteps of a year from the raw output and store one file per
+    variable in <experiment>/<variable>/<variable>_<year>.nc. The raw files are read
+    only once for all variables and nothing is written to intermediate files.
+    Variables without time dimension (e.g. rotated_pole, hybrid coefficients) are
+    kept in every file.
+    :param variables: variables to keep
+    :param levels: vertical levels (lev and lev_2) to keep, e.g. raw_levels, None keeps
+        all levels
+    """
+    experiment_path = data_path + experiment + "/"
+    filenames = sorted(glob.glob(experiment_path + "raw_data/*t" + str(year) + "*.nc"))
+    if not filenames:
+        raise FileNotFoundError("No raw data for " + experiment + " " + str(year))
+
+    def _select(ds):
+        static = [var for var in ds.data_vars if "time" not in ds[var].dims]
+        ds = ds[variables + static]
+        if levels is not None:
+            ds = ds.sel({dim: levels for dim in ["lev", "lev_2"] if dim in ds.dims})
+        return ds
+
+    ds = xr.open_mfdataset(
+        filenames,
+        combine="nested",
+        concat_dim="time",
+        data_vars="minimal",
+        coords="minimal",
+        compat="override",
+        preprocess=_select,
+    )
+    static = [var for var in ds.data_vars if "time" not in ds[var].dims]
+    for directory in variables + ["FI_interpolated", "S"]:
+        os.makedirs(experiment_path + directory, exist_ok=True)
+    writes = [
+        write_dataset(
+            ds[[variable] + static],
+            experiment_path + variable + "/" + variable + "_" + str(year) + ".nc",
+            compute=False,
         )
+        for variable in variables
+    ]
+    dask.compute(*writes)
+
+
+def average_neighbours(x, axis, out):
+    """
+    Mean of neighbouring values along axis, written to out without temporaries.
+    out[i] = (x[i - 1] + x[i]) / 2, the first element along axis is NaN
+    (same as rolling(2).mean())
+    """
+    x = np.moveaxis(x, axis, 0)
+    out_moved = np.moveaxis(out, axis, 0)
+    np.add(x[1:], x[:-1], out=out_moved[1:])
+    out_moved[0] = np.nan
+    out *= 0.5
+    return out
+
+
+def destagger_wind_speed(U, V, out=None):
+    """
+    Wind speed at the grid centers from wind components on the staggered grids.
+    The last two axes are (rlat, rlon_2) for U and (rlat_2, rlon) for V.
+    Apart from out, only one temporary of the size of V is allocated.
+    """
+    if out is None:
+        out = np.empty(U.shape)
+    average_neighbours(U, -1, out)
+    np.square(out, out=out)
+    v = average_neighbours(V, -2, np.empty(V.shape))
+    np.square(v, out=v)
+    out += v
+    return np.sqrt(out, out=out)
+
+
+def interpolate_geopotential(ds, ds_ground, time_chunk=124):
+    """
+    Combine ground geopotential (FIB) with upper levels (FI) and interpolate from lev_2 to lev.
+    lev is defined between lev_2, the geopotential on lev is the mean of the neighbouring
+    lev_2 levels (and of the lowest lev_2 level and the ground for the lowest level).
+    Data is processed in blocks of time_chunk timesteps.
+    :param ds: geopotential FI on lev_2, all levels or consecutive levels down to the
+        lowest one (e.g. raw_levels). The output has the same levels on lev.
+    :param ds_ground: surface geopotential FIB
+    :return: geopotential on lev
+    """
+    lev_2 = ds["FI"].lev_2.values
+    # the lowest level is combined with the ground (raw_levels[-1] = 27)
+    if not (np.diff(lev_2) == 1).all() or lev_2[-1] != raw_levels[-1]:
+        raise ValueError("lev_2 must be consecutive levels down to the lowest level")
+    FI = ds["FI"].transpose("time", "lev_2", "rlat", "rlon")
+    FIB = ds_ground["FIB"].transpose("time", "rlat", "rlon")
+    out = np.empty(FI.shape)
+    for t in range(0, FI.time.size, time_chunk):
+        block = slice(t, t + time_chunk)
+        FI_block, out_block = FI[block].values, out[block]
+        np.add(FI_block[:, :-1], FI_block[:, 1:], out=out_block[:, :-1])
+        np.add(FI_block[:, -1], FIB[block].values, out=out_block[:, -1])
+        out_block *= 0.5
+    # Use lev and align counting with other datasets
+    ds_combined = ds.drop_vars(["FI", "hyai", "hybi", "hyam", "hybm"]).drop_dims(
+        "lev_2", errors="ignore"
+    )
+    ds_combined["FI"] = (("time", "lev", "rlat", "rlon"), out, ds["FI"].attrs)
+    ds_combined = ds_combined.assign_coords({"lev": lev_2})
+    return ds_combined
+
+
+def compute_wind_speed(ds_u, ds_v, time_chunk=124):
+    """
+    Compute wind speeds from half-shifted wind components. The wind components at the
+    grid center are the mean of the components at the western and eastern (U) and
+    northern and southern (V) margins. Data is processed in blocks of time_chunk
+    timesteps.
+    :param ds_u: U on rlon_2
+    :param ds_v: V on rlat_2
+    :return: wind speeds S on the grid centers
+    """
+    U = ds_u["U"].transpose("time", "lev", "rlat", "rlon_2")
+    V = ds_v["V"].transpose("time", "lev", "rlat_2", "rlon")
+    S = np.empty(U.shape)
+    for t in range(0, U.time.size, time_chunk):
+        block = slice(t, t + time_chunk)
+        destagger_wind_speed(U[block].values, V[block].values, out=S[block])
+
+    # keep all other variables and coordinates, but not the staggered ones
+    ds = xr.merge(
+        [
+            ds_u.drop_vars(["U"]).drop_dims("rlon_2"),
+            ds_v.drop_vars(["V"]).drop_dims("rlat_2"),
+        ]
+    )
+    ds["S"] = xr.DataArray(
+        S,
+        dims=("time", "lev", "rlat", "rlon"),
+        coords={"rlat": ds_u.rlat, "rlon": ds_v.rlon},
+    )
+    ds.S.attrs = {
+        "long_name": "Wind speed",
+        "units": "m/s",
+        "grid_mapping": "rotated_pole",
+    }
+    return ds
+
+
+def interpolate_geopotential_rolling(ds, ds_ground):
+    """
+    Reference implementation of interpolate_geopotential using xarray rolling means
+    """
+    ds = ds.drop_vars(["hyai", "hybi", "hyam", "hybm"])
+    # Assign lev_2 coordinate to the surface geopotential (counted from top of atmoshere down)
+    ds_ground = ds_ground.assign_coords({"lev_2": 28.0}).rename(
+        {"FIB": "FI"}
+    )  # ground is lowermost level
+    # Combine surface and further up
+    ds_combined = xr.concat([ds, ds_ground], dim="lev_2")
+    # Perform rolling mean interpolation (lev is defined between lev_2)
+    ds_combined = ds_combined.rolling({"lev_2": 2}).mean().dropna("lev_2")
+    # Rename variable from lev_2 to lev and align counting with other datasets
+    ds_combined = ds_combined.rename({"lev_2": "lev"}).assign_coords(
+        {"lev": ds["FI"].lev_2.values}
+    )
+    return ds_combined
+
+
+def compute_wind_speed_rolling(ds_u, ds_v):
+    """
+    Reference implementation of compute_wind_speed using xarray rolling means
+    """
+    # u wind component at grid center is mean of u at its western and eastern margin
+    ds_u = ds_u.rolling({"rlon_2": 2}).mean()
+    ds_u = ds_u.rename({"rlon_2": "rlon"}).assign_coords({"rlon": ds_v.rlon})
+    # same for v with northern & southern margin
+    ds_v = ds_v.rolling({"rlat_2": 2}).mean()
+    ds_v = ds_v.rename({"rlat_2": "rlat"}).assign_coords({"rlat": ds_u.rlat})
+
+    # Compute wind speeds from components
+    ds = xr.merge([ds_u, ds_v])
+    ds["S"] = (ds.U**2 + ds.V**2)**(1./2)
+    ds.S.attrs = {"long_name": "Wind speed", "units": "m/s", "grid_mapping": "rotated_pole"}
+
+    # drop non-needed vars
+    return ds.drop_vars(["U", "V"])
+
+
+def preprocess_year(year_experiment, split=True):
+    """
+    Preprocess one year of one experiment: split the raw output per variable,
+    interpolate the geopotential to lev and compute wind speeds from the
+    half-shifted wind components
+    :param year_experiment: tuple (year, experiment)
+    :param split: if False, the per-variable files are expected to exist already
+    :return: year, experiment and runtime in s
+    """
+    t_0 = time.time()
+    year, experiment = year_experiment
+    if split:
+        split_raw_data(year, experiment, levels=raw_levels)
+    # Load geopotential and surface geopotential
+    ds = xr.open_dataset(data_path + experiment + "/FI/FI_" + str(year) + ".nc")
+    ds_ground = xr.open_dataset(
+        data_path + experiment + "/FIB/FIB_" + str(year) + ".nc"
+    )  # Geopotential at surface
+    write_dataset(
+        interpolate_geopotential(ds, ds_ground),
+        data_path + experiment + "/FI_interpolated/FI_" + str(year) + ".nc",
+    )
+    # Open wind components, compute wind speeds and save
+    ds_u = xr.open_dataset(data_path + experiment + "/U/U_" + str(year) + ".nc")
+    ds_v = xr.open_dataset(data_path + experiment + "/V/V_" + str(year) + ".nc")
+    write_dataset(
+        compute_wind_speed(ds_u, ds_v),
+        data_path + experiment + "/S/S_" + str(year) + ".nc",
+    )
+    return year, experiment, time.time() - t_0
+
+
+def run_parallel(
+    years=range(1986, 2016), experiments=EXPERIMENTS, n_workers=None, split=True
+):
+    """
+    Preprocess all years and experiments in parallel, one task per year and experiment
+    :param n_workers: number of processes, defaults to the number of CPUs
+    :param split: split the raw output per variable first (see preprocess_year)
+    """
+    tasks = [(year, experiment) for year in years for experiment in experiments]
+    with Pool(n_workers) as pool:
+        for i, (year, experiment, seconds) in enumerate(
+            pool.imap_unordered(partial(preprocess_year, split=split), tasks)
+        ):
+            print(
+                str(i + 1)
+                + "/"
+                + str(len(tasks))
+                + ": "
+                + experiment
+                + " "
+                + str(year)
+                + " done after "
+                + str(int(seconds))
+                + " s"
+            )
+
 
-######################
-# Compute wind speeds from half-shifted wind components
-######################
-for year in range(1986, 2016):
-    print(year)
-    for experiment in EXPERIMENTS:
-        # Open files
-        ds_u = xr.open_dataset(data_path + experiment + "/U/U_" + str(year) + ".nc")
-        ds_v = xr.open_dataset(data_path + experiment + "/V/V_" + str(year) + ".nc")
-
-        # u wind component at grid center is mean of u at its western and eastern margin
-        ds_u = ds_u.rolling({"rlon_2": 2}).mean()
-        ds_u = ds_u.rename({"rlon_2": "rlon"}).assign_coords({"rlon": ds_v.rlon})
-        # same for v with northern & southern margin
-        ds_v = ds_v.rolling({"rlat_2": 2}).mean()
-        ds_v = ds_v.rename({"rlat_2": "rlat"}).assign_coords({"rlat": ds_u.rlat})
-
-        # Compute wind speeds from components
-        ds = xr.merge([ds_u, ds_v])
-        ds["S"] = (ds.U**2 + ds.V**2)**(1./2)
-        ds.S.attrs = {"long_name": "Wind speed", "units": "m/s", "grid_mapping": "rotated_pole"}
-
-        # drop non-needed vars and save
-        ds.drop(["U", "V"]).to_netcdf(data_path + experiment + "/S/S_" + str(year) + ".nc")
\ No newline at end of file
+if __name__ == "__main__":
+    run_parallel()
@@ -1,24 +1,38 @@
 import xarray as xr
 import glob
 from params import *
+from output_encoding import write_dataset
 
 data_path = "../data/IDL/"
 
-for year in range(1986, 2016):
-    print(year)
-    for experiment in EXPERIMENTS:
-        #open both wind components in one dataset
-        ds_list = []
-        for variable in ["ua", "va"]:
-            filename = glob.glob(
-                data_path + experiment + "/" + variable + "/*" + str(year) + "123123.nc"
-            )[0]
-            ds_list.append(xr.open_dataset(filename))
-        ds = xr.merge(ds_list)
 
-        # Compute wind speeds
-        ds["S"] = (ds["ua"] ** 2 + ds["va"] ** 2) ** (1.0 / 2)
+def compute_wind_speed(ds):
+    """
+    Compute wind speeds from both wind components and drop the components
+    """
+    ds["S"] = (ds["ua"] ** 2 + ds["va"] ** 2) ** (1.0 / 2)
+    return ds.drop(["ua", "va"])
 
-        # Drop non-needed variables and save to file
-        ds = ds.drop(["ua", "va"])
-        ds.to_netcdf(data_path + experiment + "/S/" + str(year) + ".nc")
+
+if __name__ == "__main__":
+    for year in range(1986, 2016):
+        print(year)
+        for experiment in EXPERIMENTS:
+            # open both wind components in one dataset
+            ds_list = []
+            for variable in ["ua", "va"]:
+                filename = glob.glob(
+                    data_path
+                    + experiment
+                    + "/"
+                    + variable
+                    + "/*"
+                    + str(year)
+                    + "123123.nc"
+                )[0]
+                ds_list.append(xr.open_dataset(filename))
+            ds = xr.merge(ds_list)
+
+            # Compute wind speeds, drop non-needed variables and save to file
+            ds = compute_wind_speed(ds)
+            write_dataset(ds, data_path + experiment + "/S/" + str(year) + ".nc")
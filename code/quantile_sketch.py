@@ -0,0 +1,94 @@
+# Mergeable quantile sketch (KLL, Karnin, Lang & Liberty 2016).
+# Values are added in batches to a hierarchy of compactors. When the sketch exceeds
+# its total capacity, the values of the lowest compactor above its capacity are
+# sorted and every other value (random offset) is promoted to the next level with
+# twice the weight. Memory is O(k) (at most about 3 k values) independent of
+# the number of values and sketches built on parts of the data (e.g. by parallel
+# workers or on blocks of grid cells) can be merged.
+#
+# Error bound: the rank of a returned quantile deviates from the requested rank by
+# at most about 2 / k of the number of values with high probability (1 % for the
+# default k=200). As long as fewer than k values were added, quantiles are exact
+# order statistics.
+
+import numpy as np
+
+
+class QuantileSketch:
+    def __init__(self, k=200, seed=0):
+        """
+        k: capacity of the highest compactor, controls accuracy and memory
+        seed: seed of the random compaction offsets (for reproducibility)
+        """
+        self.k = k
+        self.n = 0
+        self.levels = [np.empty(0)]
+        self._rng = np.random.default_rng(seed)
+
+    def _capacity(self, level):
+        depth = len(self.levels) - level - 1
+        return max(2, int(np.ceil(self.k * (2.0 / 3) ** depth)))
+
+    def _size(self):
+        return sum(values.size for values in self.levels)
+
+    def _total_capacity(self):
+        return sum(self._capacity(level) for level in range(len(self.levels)))
+
+    def _compress(self):
+        # lazy compaction: only compact while the sketch exceeds its total capacity,
+        # always the lowest compactor above its own capacity
+        while self._size() > self._total_capacity():
+            level = next(
+                level
+                for level, values in enumerate(self.levels)
+                if values.size > self._capacity(level)
+            )
+            if level + 1 == len(self.levels):
+                self.levels.append(np.empty(0))
+            values = np.sort(self.levels[level])
+            # an odd value out stays on this level
+            remainder, values = values[: values.size % 2], values[values.size % 2 :]
+            promoted = values[self._rng.integers(2) :: 2]
+            self.levels[level + 1] = np.concatenate([self.levels[level + 1], promoted])
+            self.levels[level] = remainder
+
+    def update(self, values):
+        """
+        Add values (any shape, NaNs are ignored)
+        """
+        values = np.asarray(values, dtype=float).ravel()
+        values = values[np.isfinite(values)]
+        self.levels[0] = np.concatenate([self.levels[0], values])
+        self.n += values.size
+        self._compress()
+        return self
+
+    def merge(self, other):
+        """
+        Add all values summarized in other
+        """
+        for level, values in enumerate(other.levels):
+            if level == len(self.levels):
+                self.levels.append(np.empty(0))
+            self.levels[level] = np.concatenate([self.levels[level], values])
+        self.n += other.n
+        self._compress()
+        return self
+
+    def quantile(self, q):
+        """
+        Approximate quantile(s) q (between 0 and 1), NaN if the sketch is empty
+        """
+        values = np.concatenate(self.levels)
+        if values.size == 0:
+            return np.full(np.shape(q), np.nan)
+        weights = np.concatenate(
+            [np.full(level.size, 2.0**i) for i, level in enumerate(self.levels)]
+        )
+        order = np.argsort(values)
+        cumulative_weights = np.cumsum(weights[order])
+        idx = np.searchsorted(
+            cumulative_weights, np.asarray(q) * cumulative_weights[-1], side="left"
+        )
+        return values[order][np.clip(idx, 0, values.size - 1)]
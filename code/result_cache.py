@@ -0,0 +1,124 @@
+# Content-addressed cache for expensive reductions of the model output (e.g. 30-year
+# time means of the capacity factors, histograms). Results are stored as small NetCDF
+# files in cache_dir. The file name contains a hash of the name of the computation,
+# its parameters, the size and modification time of all input files and the source
+# code of the modules computing it, so that results are recomputed whenever the
+# inputs or the code change. The least recently used entries
+# are removed once the cache grows beyond max_size_MB.
+
+import glob
+import hashlib
+import inspect
+import json
+import os
+import xarray as xr
+from file_signature import source_signature
+
+cache_dir = "../output/cache/"
+max_size_MB = 500
+
+
+def input_signature(path):
+    """
+    Size and modification time of a file, or of the files in the top level of a
+    directory (e.g. the consolidated metadata of a zarr store)
+    """
+    if os.path.isdir(path):
+        return [
+            [f, source_signature(os.path.join(path, f))]
+            for f in sorted(os.listdir(path))
+            if os.path.isfile(os.path.join(path, f))
+        ]
+    return source_signature(path)
+
+
+def _to_json(obj):
+    if hasattr(obj, "tolist"):  # numpy arrays and scalars
+        return obj.tolist()
+    return str(obj)
+
+
+def code_signature(code):
+    """
+    Content hash of the source files of modules or functions
+    """
+    filenames = sorted(set(inspect.getsourcefile(obj) for obj in code))
+    sha = hashlib.sha256()
+    # functions defined interactively have no source file
+    for filename in filter(os.path.isfile, filenames):
+        with open(filename, "rb") as f:
+            sha.update(f.read())
+    return sha.hexdigest()
+
+
+def cache_key(name, inputs, params=None, code=()):
+    """
+    Hash of the computation name, the input files, the parameters and the source code
+    """
+    description = {
+        "name": name,
+        "inputs": [[os.path.normpath(p), input_signature(p)] for p in sorted(inputs)],
+        "params": params,
+        "code": code_signature(code),
+    }
+    text = json.dumps(description, sort_keys=True, default=_to_json)
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+def _save(result, filename):
+    """
+    Store an xr.Dataset or a flat pd.DataFrame as NetCDF (written to a temporary file
+    first so that interrupted writes leave no broken entries)
+    """
+    if isinstance(result, xr.Dataset):
+        ds = result
+    else:
+        ds = xr.Dataset.from_dataframe(result)
+        ds.attrs["pandas_index"] = result.index.name or ""
+    os.makedirs(cache_dir, exist_ok=True)
+    ds.to_netcdf(filename + ".tmp")
+    os.replace(filename + ".tmp", filename)
+
+
+def _load(filename):
+    ds = xr.load_dataset(filename)
+    if "pandas_index" not in ds.attrs:
+        return ds
+    df = ds.to_dataframe()
+    df.index.name = ds.attrs["pandas_index"] or None
+    return df
+
+
+def evict(max_size_MB=max_size_MB):
+    """
+    Remove least recently used entries until the cache is smaller than max_size_MB
+    """
+    filenames = sorted(glob.glob(cache_dir + "*.nc"), key=os.path.getmtime)
+    size = sum(os.path.getsize(f) for f in filenames)
+    while filenames and size > max_size_MB * 1e6:
+        filename = filenames.pop(0)
+        size -= os.path.getsize(filename)
+        os.remove(filename)
+
+
+def cached(name, inputs, compute, params=None, code=()):
+    """
+    Result of compute() (xr.Dataset or flat pd.DataFrame), loaded from the cache if it
+    was computed before from unchanged inputs and code with the same parameters
+    :param name: name of the computation, used as prefix of the cache file
+    :param inputs: list of input files or directories (zarr stores)
+    :param compute: function without arguments computing the result
+    :param params: parameters of the computation (json serializable, numpy arrays
+        are allowed)
+    :param code: further modules or functions used by compute, their source is part
+        of the key in addition to the module defining compute
+    """
+    key = cache_key(name, inputs, params, [compute] + list(code))
+    filename = cache_dir + name + "_" + key[:24] + ".nc"
+    if os.path.exists(filename):
+        os.utime(filename)  # mark as recently used
+        return _load(filename)
+    result = compute()
+    _save(result, filename)
+    evict()
+    return result
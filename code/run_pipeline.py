@@ -0,0 +1,319 @@
+# Dependency-aware execution of all scripts (replaces the plain sequence in main.sh).
+#
+# Every script is a task with file inputs, file outputs and upstream tasks:
+#   preprocess -> monthly / sub-daily / summer nights (one pass) -> hub height -> power
+#   -> analysis
+# A task is skipped if all its outputs exist and its inputs did not change since
+# its last successful run. Code inputs (scripts, shared modules, parameters) are
+# compared by content hash, data inputs by size and modification time (or content
+# hash with --hash-data). Independent tasks run at the same time on a pool of
+# workers. The state is saved after every task so that an interrupted run resumes
+# where it stopped.
+
+import argparse
+import glob
+import hashlib
+import json
+import os
+import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+state_file = "../output/pipeline_state.json"
+log_dir = "../output/logs/"
+
+shared_code = [
+    "utils.py",
+    "params.py",
+    "approximate_heights.yaml",
+    "output_encoding.py",
+    "timeseries_store.py",
+    "file_signature.py",  # imported by timeseries_store
+]
+power_code = ["utils_from_CESM2energy.py", "power_curves.py", "../output/*.p"]
+
+IDL_S = "../data/IDL/*/S/*.nc"
+GERICS_S = "../data/GERICS/*/S/*.nc"
+
+
+class Task:
+    """
+    A script together with the files it reads and writes.
+
+    name: unique name of the task
+    command: command executed in the code directory
+    inputs: glob patterns of code and data the task reads
+    outputs: glob patterns of the files the task writes (each needs to match a file)
+    depends: names of the tasks that need to finish first
+    """
+
+    def __init__(self, name, command, inputs=(), outputs=(), depends=()):
+        self.name = name
+        self.command = command
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.depends = list(depends)
+
+
+def python_task(script, inputs=(), outputs=(), depends=(), extra_code=()):
+    return Task(
+        script.replace(".py", ""),
+        ["python", script],
+        [script] + shared_code + list(extra_code) + list(inputs),
+        outputs,
+        depends,
+    )
+
+
+TASKS = [
+    ###############
+    # Preprocessing
+    ###############
+    python_task(
+        "preprocess_GERICS.py",
+        ["../data/GERICS/*/raw_data/*.nc"],
+        ["../data/GERICS/*/FI_interpolated/*.nc", GERICS_S],
+    ),
+    Task(
+        "preprocess_IDL_cleanup", ["bash", "preprocess_IDL.sh"], ["preprocess_IDL.sh"]
+    ),
+    python_task(
+        "preprocess_IDL.py",
+        ["../data/IDL/*/ua/*.nc", "../data/IDL/*/va/*.nc"],
+        [IDL_S],
+        ["preprocess_IDL_cleanup"],
+    ),
+    ###############
+    # Computation
+    ###############
+    python_task(
+        "compute_approximate_heights.py",
+        ["../data/GERICS/GRASS/FI_interpolated/FI_2000.nc", "../data/IDL/*_fx.nc"],
+        ["../plots/vertical_coordinate/*.jpeg"],
+        ["preprocess_GERICS"],
+    ),
+    python_task(
+        "compute_wind_aggregates.py",
+        [IDL_S, GERICS_S],
+        [
+            "../data/monthly/*/S_*.nc",
+            "../data/sub-daily/*/S_*.nc",
+            "../data/summernights_IDL/*/S_IDL_summernights.nc",
+        ],
+        ["preprocess_GERICS", "preprocess_IDL"],
+        extra_code=[
+            "aggregation.py",
+            "compute_monthly_winds.py",
+            "compute_subdaily_focusareas.py",
+            "compute_IDL_summer_nights.py",
+        ],
+    ),
+    python_task(
+        "compute_hub_height.py",
+        [
+            IDL_S,
+            GERICS_S,
+            "../data/IDL/*/zg/*.nc",
+            "../data/IDL/*_fx.nc",
+            "../data/GERICS/*/FI_interpolated/*.nc",
+            "../data/GERICS/*/FIB/*.nc",
+        ],
+        ["../output/hub_height_wind/S_hub_*.nc", "../output/hub_height_wind/*.zarr"],
+        ["preprocess_GERICS", "preprocess_IDL"],
+        extra_code=["wind_data.py", "scheduler.py"],
+    ),
+    python_task(
+        "compute_power.py",
+        ["../output/hub_height_wind/S_hub_*.nc"],
+        ["../output/generation/*.nc", "../output/generation/*.zarr"],
+        ["compute_hub_height"],
+        extra_code=power_code
+        + [
+            "compute_hub_height.py",
+            "wind_data.py",
+            "scheduler.py",
+        ],
+    ),
+    ###############
+    # Analysis / Plotting
+    ###############
+    python_task(
+        "analyze_monthly_means.py",
+        ["../data/monthly/*/S_*.nc"],
+        ["../output/Table_absolute_change_*.txt"],
+        ["compute_wind_aggregates"],
+        extra_code=["online_statistics.py", "quantile_sketch.py"],
+    ),
+    python_task(
+        "analyze_subdaily.py",
+        ["../data/sub-daily/*/S_*.nc"],
+        ["../plots/exploration/sub-daily/Profile_*.jpeg"],
+        ["compute_wind_aggregates"],
+    ),
+    python_task(
+        "analyze_summernights_IDL.py",
+        ["../data/summernights_IDL/*/S_IDL_summernights.nc"],
+        ["../plots/summernights_IDL/*"],
+        ["compute_wind_aggregates"],
+    ),
+    python_task(
+        "analyze_generation.py",
+        ["../output/generation/*.nc"],
+        ["../output/CF_histograms.csv", "../plots/generation/*.png"],
+        ["compute_power"],
+        extra_code=["histograms.py", "result_cache.py"],
+    ),
+]
+
+
+def file_hash(filename):
+    sha = hashlib.sha256()
+    with open(filename, "rb") as file:
+        for block in iter(lambda: file.read(2**20), b""):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def is_code(filename):
+    return os.path.splitext(filename)[1] in [".py", ".sh", ".yaml", ".p"]
+
+
+def input_signature(task, hash_data=False):
+    """
+    Combined hash of all input files of a task. Code is hashed by content, data by
+    size and modification time unless hash_data is True.
+    """
+    sha = hashlib.sha256(" ".join(task.command).encode())
+    for pattern in task.inputs:
+        for filename in sorted(glob.glob(pattern)):
+            if is_code(filename) or hash_data:
+                fingerprint = file_hash(filename)
+            else:
+                stat = os.stat(filename)
+                fingerprint = str(stat.st_size) + "_" + str(stat.st_mtime_ns)
+            sha.update((filename + fingerprint).encode())
+    return sha.hexdigest()
+
+
+def outputs_exist(task):
+    return all(glob.glob(pattern) for pattern in task.outputs)
+
+
+def load_state():
+    if os.path.exists(state_file):
+        with open(state_file) as file:
+            return json.load(file)
+    return {}
+
+
+def save_state(state):
+    os.makedirs(os.path.dirname(state_file), exist_ok=True)
+    with open(state_file + ".tmp", "w") as file:
+        json.dump(state, file, indent=2)
+    os.replace(state_file + ".tmp", state_file)  # atomic, survives crashes
+
+
+def run_task(task):
+    """
+    Execute a task and write its output to log_dir
+    :return: True if successful
+    """
+    os.makedirs(log_dir, exist_ok=True)
+    with open(log_dir + task.name + ".log", "w") as log:
+        result = subprocess.run(task.command, stdout=log, stderr=subprocess.STDOUT)
+    return result.returncode == 0
+
+
+def run_pipeline(tasks=TASKS, n_workers=4, force=(), hash_data=False, dry_run=False):
+    """
+    Run all tasks in dependency order, skipping tasks that are up to date
+    :param tasks: list of Task
+    :param n_workers: maximum number of tasks running at the same time
+    :param force: names of tasks that are executed in any case
+    :param hash_data: compare data inputs by content instead of size and mtime
+    :param dry_run: only print which tasks would be executed
+    :return: dictionary task name -> "skipped", "done", "failed" or "blocked"
+    """
+    tasks = {task.name: task for task in tasks}
+    state = load_state()
+    status = {}
+    rerun = set()  # tasks that were executed in this run, forcing their dependents
+
+    def _ready(task):
+        return all(status.get(dep) in ["skipped", "done"] for dep in task.depends)
+
+    with ThreadPoolExecutor(max_workers=n_workers) as pool:
+        running = {}
+        while len(status) < len(tasks):
+            for name, task in tasks.items():
+                if name in status or name in running.values():
+                    continue
+                if any(
+                    status.get(dep) in ["failed", "blocked"] for dep in task.depends
+                ):
+                    status[name] = "blocked"
+                    print(name + ": blocked by failed dependency")
+                    continue
+                if not _ready(task):
+                    continue
+                signature = input_signature(task, hash_data)
+                up_to_date = (
+                    state.get(name) == signature
+                    and outputs_exist(task)
+                    and name not in force
+                    and not rerun.intersection(task.depends)
+                )
+                if up_to_date:
+                    status[name] = "skipped"
+                    print(name + ": up to date")
+                elif dry_run:
+                    status[name] = "done"
+                    rerun.add(name)
+                    print(name + ": would run")
+                else:
+                    print(name + ": running")
+                    future = pool.submit(run_task, task)
+                    future.signature = signature
+                    future.t_0 = time.time()
+                    running[future] = name
+            if not running:
+                if not any(name not in status for name in tasks):
+                    break
+                if not any(_ready(tasks[name]) for name in tasks if name not in status):
+                    raise ValueError("Unknown or circular task dependencies")
+                continue
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                name = running.pop(future)
+                minutes = str(round((time.time() - future.t_0) / 60, 1))
+                if future.result():
+                    status[name] = "done"
+                    rerun.add(name)
+                    state[name] = future.signature
+                    save_state(state)
+                    print(name + ": done after " + minutes + " min")
+                else:
+                    status[name] = "failed"
+                    state.pop(name, None)
+                    save_state(state)
+                    print(name + ": failed, see " + log_dir + name + ".log")
+    return status
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Run all scripts, skipping steps that are up to date"
+    )
+    parser.add_argument("-j", "--workers", type=int, default=4)
+    parser.add_argument("--force", nargs="*", default=[], help="tasks to rerun")
+    parser.add_argument("--hash-data", action="store_true")
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+    status = run_pipeline(
+        n_workers=args.workers,
+        force=args.force,
+        hash_data=args.hash_data,
+        dry_run=args.dry_run,
+    )
+    if any(s in ["failed", "blocked"] for s in status.values()):
+        raise SystemExit(1)
@@ -0,0 +1,181 @@
+# Memory-aware scheduling of the yearly tasks of compute_hub_height.py and
+# compute_power.py.
+# All (institution, experiment, year) tasks are run from one queue. A task is started
+# as soon as a core is free and its estimated memory fits into what the running tasks
+# leave of the available RAM; smaller tasks (e.g. 6-hourly GERICS) fill the gaps next
+# to large ones (hourly IDL). The memory of a task is estimated from the dimensions of
+# its input, capped by its memory budget which limits the time chunks it processes at
+# once. Tasks failing with a MemoryError are retried with half the memory budget,
+# i.e. smaller time chunks. If a worker is killed (e.g. by the out-of-memory killer),
+# the whole pool breaks and it is unknown which task caused it: all running tasks are
+# restarted, but only the largest one with half its memory budget. That task is run
+# alone, so that a further crash can be attributed to it.
+
+import os
+import time
+import dask
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+process_overhead = 3e8  # memory of a worker process without data (bytes)
+
+
+class Task:
+    def __init__(self, label, function, args, full_memory, memory_budget):
+        """
+        function(*args, memory_budget=memory_budget) is executed in a worker
+        label: name of the task used in progress messages
+        full_memory: estimated memory (bytes) to process the task in a single chunk
+        memory_budget: memory (bytes) available for the chunks of the task
+        """
+        self.label = label
+        self.function = function
+        self.args = args
+        self.full_memory = full_memory
+        self.memory_budget = memory_budget
+        self.retries = 0
+        self.isolated = False  # run without other tasks in parallel
+
+    def memory(self):
+        return min(self.full_memory, self.memory_budget) + process_overhead
+
+    def run(self):
+        t_0 = time.time()
+        self.function(*self.args, memory_budget=self.memory_budget)
+        return time.time() - t_0
+
+
+def available_memory():
+    """
+    Available RAM in bytes (MemAvailable on Linux, total memory otherwise)
+    """
+    try:
+        with open("/proc/meminfo") as file:
+            for line in file:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+
+
+def available_cores():
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count()
+
+
+def _init_worker(initializer, initargs):
+    # one core per task: chunks are computed one after another within a worker
+    dask.config.set(scheduler="synchronous")
+    if initializer is not None:
+        initializer(*initargs)
+
+
+def _run(task):
+    return task.run()
+
+
+def run_tasks(
+    tasks,
+    n_workers=None,
+    memory=None,
+    initializer=None,
+    initargs=(),
+    min_budget=5e7,
+    max_retries=3,
+):
+    """
+    Run tasks in parallel within the available memory and cores
+    :param tasks: list of Task, started in this order whenever they fit
+    :param n_workers: maximum number of parallel tasks, defaults to the available cores
+    :param memory: memory (bytes) for all tasks, defaults to 80% of the available RAM
+    :param initializer, initargs: worker initialization as for multiprocessing.Pool
+        (e.g. **power_curves.pool_kwargs())
+    :param min_budget: the memory budget of a task is not reduced below min_budget
+    :param max_retries: number of retries after running out of memory
+    """
+    n_workers = n_workers or available_cores()
+    memory = memory or 0.8 * available_memory()
+    pending = list(tasks)
+    running = {}  # future -> task
+    n_done = 0
+
+    def _new_executor():
+        return ProcessPoolExecutor(
+            n_workers, initializer=_init_worker, initargs=(initializer, initargs)
+        )
+
+    def _retry(task, reason):
+        task.retries += 1
+        if task.retries > max_retries:
+            raise MemoryError(
+                task.label
+                + " failed "
+                + str(task.retries)
+                + " times for lack of memory"
+            )
+        task.memory_budget = max(min_budget, task.memory_budget / 2)
+        print(task.label + " " + reason + ", retrying with smaller chunks")
+        pending.insert(0, task)
+
+    executor = _new_executor()
+    try:
+        while pending or running:
+            # start all pending tasks that fit (first fit, in queue order)
+            used = sum(task.memory() for task in running.values())
+            for task in list(pending):
+                if len(running) == n_workers or any(
+                    running_task.isolated for running_task in running.values()
+                ):
+                    break
+                if task.isolated and running:
+                    break  # started once the running tasks are done
+                if not running:
+                    # shrink chunks if even a single task does not fit
+                    while task.memory() > memory and task.memory_budget > min_budget:
+                        task.memory_budget = max(min_budget, task.memory_budget / 2)
+                elif used + task.memory() > memory:
+                    continue
+                pending.remove(task)
+                running[executor.submit(_run, task)] = task
+                used += task.memory()
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            broken = []  # tasks that were running when the pool broke
+            for future in done:
+                task = running.pop(future)
+                try:
+                    seconds = future.result()
+                except MemoryError:
+                    _retry(task, "ran out of memory")
+                    continue
+                except BrokenProcessPool:
+                    broken.append(task)
+                    continue
+                n_done += 1
+                print(
+                    str(n_done)
+                    + "/"
+                    + str(len(tasks))
+                    + ": "
+                    + task.label
+                    + " done after "
+                    + str(int(seconds))
+                    + " s"
+                )
+            if broken:
+                # the whole pool is unusable, all running tasks are restarted
+                broken += list(running.values())
+                running = {}
+                executor.shutdown(cancel_futures=True)
+                executor = _new_executor()
+                largest = max(broken, key=lambda task: task.memory())
+                for task in reversed(broken):
+                    if task is not largest:
+                        pending.insert(0, task)  # without penalty
+                largest.isolated = True
+                _retry(
+                    largest, "was killed" if len(broken) == 1 else "was probably killed"
+                )
+    finally:
+        executor.shutdown()
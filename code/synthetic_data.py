@@ -0,0 +1,498 @@
+# Synthetic datasets that mimic the structure of the LUCAS IDL and GERICS output
+# (rotated pole EUR-44 grids, mlev / lev / lev_2 vertical coordinates, staggered
+# rlon_2 / rlat_2 wind components, 1h and 6h time axes). Values are random but
+# physically plausible. Used for benchmarking without the multi-TB input data.
+#
+# write_synthetic_archive writes complete fake ../data/IDL and ../data/GERICS trees
+# with the file names expected by the preprocess_ and compute_ scripts. With
+# time_chunk set, data is generated lazily with dask and written block by block,
+# so that full size years can be generated with little memory.
+
+import calendar
+import os
+import dask.array
+import numpy as np
+import pandas as pd
+import xarray as xr
+from params import horizontal_ranges
+
+POLE = (-162.0, 39.25)  # rotated pole in EURO-CORDEX
+grid_spacing = 0.44
+static_seed = 0  # seed of the static fields (orog, sflt, FIB), same for all years
+
+# number of grid cells (rlat, rlon). GERICS has a larger domain than IDL, which is
+# cropped by 8 cells at the lower and 10 (rlat) or 15 (rlon) cells at the upper end
+grid_shapes = {"IDL": (103, 106), "GERICS": (121, 129)}
+grid_offsets = {"IDL": (0, 0), "GERICS": (8, 8)}
+time_frequencies = {"IDL": "1h", "GERICS": "6h"}
+IDL_level_heights = [28, 95, 190, 300, 450, 650]  # approximate heights of mlev 0-5
+GERICS_levels = [float(x) for x in range(1, 28)]  # lev, counted from top down
+# experiment names of the raw GERICS output (see preprocess_GERICS.py)
+GERICS_experiment_codes = {"GRASS": "062008", "FOREST": "062009", "EVAL": "062010"}
+IDL_file_pattern = "_EUR-44_ECMWF-ERAINT_LUCAS_{experiment}_r1i1p1_IDL_WRFV381D_v1_"
+
+
+def rotated_grid(ins, grid_scale=1):
+    """
+    rlat and rlon coordinates of the EUR-44 grid of an institution
+    grid_scale: refine the grid by this factor (e.g. 4 for EUR-11 like sizes)
+    """
+    n_rlat, n_rlon = grid_shapes[ins]
+    offset_rlat, offset_rlon = grid_offsets[ins]
+    dx = grid_spacing / grid_scale
+    rlat = horizontal_ranges["rlats"].start - offset_rlat * grid_spacing
+    rlon = horizontal_ranges["rlons"].start - offset_rlon * grid_spacing
+    rlat = np.round(rlat + np.arange(n_rlat * grid_scale) * dx, 2)
+    rlon = np.round(rlon + np.arange(n_rlon * grid_scale) * dx, 2)
+    return rlat, rlon
+
+
+def time_axis(ins, n_days, start="1986-01-01", freq=None):
+    """
+    Hourly (IDL) or 6-hourly (GERICS) time axis, unless freq is given
+    """
+    if freq is None:
+        freq = time_frequencies[ins]
+    n_steps = int(n_days * pd.Timedelta("1D") / pd.Timedelta(freq))
+    return pd.date_range(start=start, periods=n_steps, freq=freq)
+
+
+def _rng(seed, time_chunk):
+    """
+    Random number generator, lazy (dask) if the data is to be chunked in time
+    """
+    if time_chunk:
+        return dask.array.random.default_rng(seed)
+    return np.random.default_rng(seed)
+
+
+def _draw(rng, distribution, size, time_chunk, *args):
+    """
+    Draw random numbers of shape size. The first dimension is time and is split
+    into chunks of time_chunk steps if rng is a dask generator.
+    """
+    kwargs = {"size": size}
+    if time_chunk:
+        kwargs["chunks"] = (time_chunk,) + tuple(size[1:])
+    return getattr(rng, distribution)(*args, **kwargs)
+
+
+def _broadcast_time(field, n_time, time_chunk):
+    """
+    Repeat a static 2D field along a new leading time dimension
+    """
+    shape = (n_time,) + field.shape
+    if time_chunk:
+        return dask.array.broadcast_to(field, shape, chunks=(time_chunk,) + field.shape)
+    return np.broadcast_to(field, shape).copy()
+
+
+def rotated_pole():
+    return xr.DataArray(
+        0,
+        attrs={
+            "grid_mapping_name": "rotated_latitude_longitude",
+            "grid_north_pole_longitude": POLE[0],
+            "grid_north_pole_latitude": POLE[1],
+        },
+    )
+
+
+def _wind_profile(rng, shape, heights, time_chunk=None):
+    """
+    Wind speeds following a power law with random exponent and reference speed.
+    The vertical dimension is the second axis, heights has the same size.
+    """
+    heights = np.asarray(heights, dtype=float).reshape(1, -1, 1, 1)
+    size = (shape[0], 1) + tuple(shape[2:])
+    s_ref = _draw(rng, "weibull", size, time_chunk, 2.0) * 7
+    alpha = _draw(rng, "uniform", size, time_chunk, 0.05, 0.4)
+    return s_ref * (heights / heights.min()) ** alpha
+
+
+def _components(rng, speed, time_chunk=None):
+    direction = _draw(rng, "uniform", speed.shape, time_chunk, 0, 2 * np.pi)
+    return speed * np.cos(direction), speed * np.sin(direction)
+
+
+def _time_bounds(time):
+    step = time[1] - time[0] if time.size > 1 else pd.Timedelta("1h")
+    return (("time", "bnds"), np.stack([time - step, time], axis=1))
+
+
+def IDL_wind_components(
+    n_days=7,
+    n_levels=6,
+    grid_scale=1,
+    seed=0,
+    start="1986-01-01",
+    freq=None,
+    time_chunk=None,
+):
+    """
+    ua and va on mlev as in the IDL output
+    """
+    rng = _rng(seed, time_chunk)
+    rlat, rlon = rotated_grid("IDL", grid_scale)
+    time = time_axis("IDL", n_days, start, freq)
+    heights = np.interp(range(n_levels), range(6), IDL_level_heights)
+    shape = (time.size, n_levels, rlat.size, rlon.size)
+    ua, va = _components(
+        rng, _wind_profile(rng, shape, heights, time_chunk), time_chunk
+    )
+    dims = ("time", "mlev", "rlat", "rlon")
+    attrs = {"units": "m s-1", "grid_mapping": "rotated_pole"}
+    return xr.Dataset(
+        {
+            "ua": (dims, ua, attrs),
+            "va": (dims, va, attrs),
+            "rotated_pole": rotated_pole(),
+            "time_bnds": _time_bounds(time),
+        },
+        coords={"time": time, "rlat": rlat, "rlon": rlon},
+    )
+
+
+def IDL_orography(grid_scale=1, seed=static_seed):
+    rng = np.random.default_rng(seed)
+    rlat, rlon = rotated_grid("IDL", grid_scale)
+    orog = rng.gamma(1.0, 300, size=(rlat.size, rlon.size))
+    return xr.Dataset(
+        {"orog": (("rlat", "rlon"), orog, {"units": "m"})},
+        coords={
+            "rlat": rlat,
+            "rlon": rlon,
+            "lat": (("rlat", "rlon"), np.zeros_like(orog)),
+            "lon": (("rlat", "rlon"), np.zeros_like(orog)),
+        },
+    )
+
+
+def IDL_land_area_fraction(grid_scale=1, seed=static_seed):
+    """
+    Land area fraction sflt in % as used by utils.compute_land_sea_mask
+    """
+    rng = np.random.default_rng(seed)
+    rlat, rlon = rotated_grid("IDL", grid_scale)
+    sflt = np.where(rng.random((rlat.size, rlon.size)) < 0.4, 100.0, 0.0)
+    return xr.Dataset(
+        {"sflt": (("rlat", "rlon"), sflt, {"units": "%"})},
+        coords={"rlat": rlat, "rlon": rlon},
+    )
+
+
+def IDL_geopotential_height(
+    n_days=7,
+    n_levels=6,
+    grid_scale=1,
+    seed=0,
+    start="1986-01-01",
+    freq=None,
+    time_chunk=None,
+):
+    """
+    Geopotential height zg on mlev including orography
+    """
+    rng = _rng(seed, time_chunk)
+    rlat, rlon = rotated_grid("IDL", grid_scale)
+    time = time_axis("IDL", n_days, start, freq)
+    heights = np.interp(range(n_levels), range(6), IDL_level_heights)
+    orog = IDL_orography(grid_scale)["orog"].values  # static, independent of seed
+    shape = (time.size, n_levels, rlat.size, rlon.size)
+    zg = (
+        orog[None, None]
+        + heights[None, :, None, None]
+        + _draw(rng, "normal", shape, time_chunk, 0, 2)
+    )
+    return xr.Dataset(
+        {"zg": (("time", "mlev", "rlat", "rlon"), zg, {"units": "m"})},
+        coords={"time": time, "rlat": rlat, "rlon": rlon},
+    )
+
+
+def GERICS_hybrid_coefficients():
+    return {
+        "hyai": ("nhyi", np.linspace(0, 1, 28)),
+        "hybi": ("nhyi", np.linspace(0, 1, 28)),
+        "hyam": ("nhym", np.linspace(0, 1, 27)),
+        "hybm": ("nhym", np.linspace(0, 1, 27)),
+    }
+
+
+def GERICS_wind_components(
+    n_days=7,
+    levels=range(22, 28),
+    grid_scale=1,
+    seed=0,
+    start="1986-01-01",
+    freq=None,
+    time_chunk=None,
+):
+    """
+    U on the staggered rlon_2 grid and V on the staggered rlat_2 grid
+    """
+    rng = _rng(seed, time_chunk)
+    rlat, rlon = rotated_grid("GERICS", grid_scale)
+    time = time_axis("GERICS", n_days, start, freq)
+    levels = [float(x) for x in levels]
+    heights = np.interp(levels, [22.0, 27.0], [1300, 30])
+    shape = (time.size, len(levels), rlat.size, rlon.size)
+    U, V = _components(rng, _wind_profile(rng, shape, heights, time_chunk), time_chunk)
+    dx = grid_spacing / grid_scale / 2
+    attrs = {"units": "m/s", "grid_mapping": "rotated_pole"}
+    ds_U = xr.Dataset(
+        {"U": (("time", "lev", "rlat", "rlon_2"), U, attrs)},
+        coords={"time": time, "lev": levels, "rlat": rlat, "rlon_2": rlon + dx},
+    )
+    ds_V = xr.Dataset(
+        {"V": (("time", "lev", "rlat_2", "rlon"), V, attrs)},
+        coords={"time": time, "lev": levels, "rlat_2": rlat + dx, "rlon": rlon},
+    )
+    for ds in [ds_U, ds_V]:
+        ds["rotated_pole"] = rotated_pole()
+        ds.update(GERICS_hybrid_coefficients())
+    return ds_U, ds_V
+
+
+def GERICS_geopotential(
+    n_days=7, grid_scale=1, seed=0, start="1986-01-01", freq=None, time_chunk=None
+):
+    """
+    Geopotential FI on the 27 half levels lev_2 (1-27) and surface geopotential FIB
+    """
+    rng = _rng(seed, time_chunk)
+    rlat, rlon = rotated_grid("GERICS", grid_scale)
+    time = time_axis("GERICS", n_days, start, freq)
+    # GERICS geopotential is used as height in m (see compute_hub_height)
+    FIB_static = np.random.default_rng(static_seed).gamma(
+        1.0, 300, size=(rlat.size, rlon.size)
+    )
+    FIB = _broadcast_time(FIB_static, time.size, time_chunk)
+    # lowest full levels (lev 26, 27) at approx. 140 and 30 m
+    half_level_heights = np.append(np.geomspace(20000, 220, 26), 60)
+    shape = (time.size, 27, rlat.size, rlon.size)
+    FI = (
+        FIB[:, None]
+        + half_level_heights[None, :, None, None]
+        + _draw(rng, "normal", shape, time_chunk, 0, 2)
+    )
+    ds_FI = xr.Dataset(
+        {"FI": (("time", "lev_2", "rlat", "rlon"), FI, {"units": "m"})},
+        coords={"time": time, "lev_2": GERICS_levels, "rlat": rlat, "rlon": rlon},
+    )
+    ds_FI.update(GERICS_hybrid_coefficients())
+    ds_FIB = xr.Dataset(
+        {"FIB": (("time", "rlat", "rlon"), FIB, {"units": "m"})},
+        coords={"time": time, "rlat": rlat, "rlon": rlon},
+    )
+    return ds_FI, ds_FIB
+
+
+def GERICS_roughness(years=range(1986, 2016), grid_scale=1, seed=0):
+    """
+    Monthly effective roughness length z0 on the GERICS grid
+    """
+    rng = np.random.default_rng(seed)
+    rlat, rlon = rotated_grid("GERICS", grid_scale)
+    time = pd.date_range(str(years[0]) + "-01-01", str(years[-1]) + "-12-01", freq="MS")
+    z0 = rng.gamma(1.0, 0.7, size=(time.size, rlat.size, rlon.size))
+    return xr.Dataset(
+        {"z0": (("time", "rlat", "rlon"), z0, {"units": "m"})},
+        coords={"time": time, "rlat": rlat, "rlon": rlon},
+    )
+
+
+def hub_height_input(ins="IDL", n_days=7, grid_scale=1, seed=0):
+    """
+    Wind speeds and heights above ground on the two levels used for the hub height
+    interpolation, as returned by compute_hub_height.open_wind_geopotential
+    """
+    rng = np.random.default_rng(seed)
+    rlat, rlon = rotated_grid(ins, grid_scale)
+    time = time_axis(ins, n_days)
+    if ins == "IDL":
+        vertical_dim, levels, level_heights = "mlev", [0, 1], [28.0, 95.0]
+    else:
+        vertical_dim, levels, level_heights = "lev", [26.0, 27.0], [140.0, 30.0]
+    shape = (time.size, 2, rlat.size, rlon.size)
+    height = np.array(level_heights)[None, :, None, None] + rng.normal(0, 2, shape)
+    dims = ("time", vertical_dim, "rlat", "rlon")
+    return xr.Dataset(
+        {
+            "S": (dims, _wind_profile(rng, shape, level_heights)),
+            "height": (dims, height),
+        },
+        coords={"time": time, vertical_dim: levels, "rlat": rlat, "rlon": rlon},
+    )
+
+
+def capacity_factors(ins="IDL", n_days=7, grid_scale=1, seed=0):
+    """
+    Capacity factor time series as written by compute_power (stored as S_hub)
+    """
+    rng = np.random.default_rng(seed)
+    rlat, rlon = rotated_grid(ins, grid_scale)
+    time = time_axis(ins, n_days)
+    CF = np.clip(rng.beta(1.2, 2.0, size=(time.size, rlat.size, rlon.size)), 0, 1)
+    CF[rng.random(CF.shape) < 0.05] = 0.0  # below cut-in
+    return xr.Dataset(
+        {"S_hub": (("time", "rlat", "rlon"), CF)},
+        coords={"time": time, "rlat": rlat, "rlon": rlon},
+    )
+
+
+def land_sea_mask(grid_scale=1, seed=static_seed):
+    """
+    Land sea mask on the IDL grid with 1 over land and NaN elsewhere
+    """
+    rng = np.random.default_rng(seed)
+    rlat, rlon = rotated_grid("IDL", grid_scale)
+    mask = np.where(rng.random((rlat.size, rlon.size)) < 0.4, 1.0, np.nan)
+    return xr.DataArray(
+        mask,
+        dims=("rlat", "rlon"),
+        coords={"rlat": rlat, "rlon": rlon},
+        name="sflt",
+    )
+
+
+##################################
+# Synthetic input data archive
+##################################
+
+
+def write_GERICS_raw_data(datasets, path, experiment, time_chunk=None):
+    """
+    Write GERICS variables as raw model output: one file per timestep with all
+    variables, named e<experiment code>t<YYYYMMDDHH>.nc as read by
+    preprocess_GERICS.split_raw_data
+    :param datasets: GERICS datasets (e.g. from GERICS_wind_components and
+        GERICS_geopotential) on the same time axis
+    :param path: raw_data directory
+    :param time_chunk: number of timesteps generated at once; limits memory
+    """
+    ds = xr.merge(datasets, compat="override")
+    step = time_chunk or ds.time.size
+    for t in range(0, ds.time.size, step):
+        block = ds.isel(time=slice(t, t + step)).compute()
+        for i in range(block.time.size):
+            block.isel(time=[i]).to_netcdf(
+                path
+                + "e"
+                + GERICS_experiment_codes[experiment]
+                + "t"
+                + block.time[i].dt.strftime("%Y%m%d%H").item()
+                + ".nc"
+            )
+
+
+def write_synthetic_archive(
+    root="../",
+    years=range(1986, 2016),
+    experiments=["GRASS", "FOREST", "EVAL"],
+    n_days=None,
+    grid_scale=1,
+    frequencies=None,
+    time_chunk=24 * 31,
+    raw_data=True,
+):
+    """
+    Write fake IDL and GERICS input data with the directory structure and file names
+    of the real archive into root/data/.
+
+    IDL: <exp>/ua, <exp>/va, <exp>/zg and the static orog and sflt files
+    GERICS: <exp>/U (rlon_2), <exp>/V (rlat_2), <exp>/FI (lev_2), <exp>/FIB and
+    roughness/z0, as produced by preprocess_GERICS.split_raw_data (on all levels),
+    and the raw output <exp>/raw_data that split_raw_data reads
+    Output directories of the preprocess_ scripts are created as well.
+
+    :param root: directory containing data/ (default: the repository)
+    :param years: years to generate
+    :param experiments: LUCAS experiments to generate
+    :param n_days: number of days per year, defaults to the full year
+    :param grid_scale: refine the EUR-44 grid by this factor
+    :param frequencies: time resolution per institution,
+        defaults to {"IDL": "1h", "GERICS": "6h"}
+    :param time_chunk: number of timesteps generated and written at once; limits memory
+    :param raw_data: write the raw GERICS output (one file per timestep)
+    """
+    if frequencies is None:
+        frequencies = time_frequencies
+    IDL_path = root + "data/IDL/"
+    GERICS_path = root + "data/GERICS/"
+    os.makedirs(IDL_path, exist_ok=True)
+    os.makedirs(GERICS_path + "roughness", exist_ok=True)
+    fx = IDL_file_pattern.format(experiment="EVAL") + "fx.nc"
+    IDL_orography(grid_scale).to_netcdf(IDL_path + "orog" + fx)
+    IDL_land_area_fraction(grid_scale).to_netcdf(IDL_path + "sflt" + fx)
+    for i_experiment, experiment in enumerate(experiments):
+        print(experiment)
+        for folder in ["ua", "va", "zg", "S"]:
+            os.makedirs(IDL_path + experiment + "/" + folder, exist_ok=True)
+        for folder in ["raw_data", "FIB", "U", "V", "FI", "FI_interpolated", "S"]:
+            os.makedirs(GERICS_path + experiment + "/" + folder, exist_ok=True)
+        GERICS_roughness(years, grid_scale, seed=i_experiment).to_netcdf(
+            GERICS_path
+            + "roughness/z0_EUR-44_ECMWF-ERAINT_LUCAS_"
+            + experiment
+            + "_GERICS-REMO2009-iMOVE_v2_mon_"
+            + str(years[0])
+            + "0101-"
+            + str(years[-1])
+            + "1231.nc"
+        )
+        for year in years:
+            print(year)
+            kwargs = {
+                "n_days": n_days or (366 if calendar.isleap(year) else 365),
+                "grid_scale": grid_scale,
+                "seed": year * 10 + i_experiment,
+                "start": str(year) + "-01-01",
+                "time_chunk": time_chunk,
+            }
+            # IDL
+            IDL_file = (
+                IDL_file_pattern.format(experiment=experiment)
+                + "1hr_"
+                + str(year)
+                + "010100-"
+                + str(year)
+                + "123123.nc"
+            )
+            ds = IDL_wind_components(freq=frequencies["IDL"], **kwargs)
+            for variable in ["ua", "va"]:
+                ds[[variable, "rotated_pole", "time_bnds"]].to_netcdf(
+                    IDL_path + experiment + "/" + variable + "/" + variable + IDL_file
+                )
+            IDL_geopotential_height(freq=frequencies["IDL"], **kwargs).to_netcdf(
+                IDL_path + experiment + "/zg/zg" + IDL_file
+            )
+            # GERICS
+            datasets = GERICS_wind_components(
+                freq=frequencies["GERICS"], **kwargs
+            ) + GERICS_geopotential(freq=frequencies["GERICS"], **kwargs)
+            if raw_data:
+                write_GERICS_raw_data(
+                    datasets,
+                    GERICS_path + experiment + "/raw_data/",
+                    experiment,
+                    time_chunk,
+                )
+            for ds in datasets:
+                variable = list(ds.data_vars)[0]
+                ds.to_netcdf(
+                    GERICS_path
+                    + experiment
+                    + "/"
+                    + variable
+                    + "/"
+                    + variable
+                    + "_"
+                    + str(year)
+                    + ".nc"
+                )
+
+
+if __name__ == "__main__":
+    # Small archive for testing: 2 years, 31 days each
+    write_synthetic_archive(years=range(1986, 1988), n_days=31)
@@ -0,0 +1,79 @@
+# Regression tests of the hub height kernel (hub_height_kernel via
+# calculate_hub_height_chunked) against the xarray implementation
+# calculate_hub_height_xr. Run with python -m pytest from code/.
+
+import numpy as np
+import pandas as pd
+import pytest
+import xarray as xr
+from benchmark_hub_height import synthetic_two_level_dataset
+from compute_hub_height import (
+    calculate_hub_height_chunked,
+    calculate_hub_height_xr,
+    hub_height_kernel,
+)
+
+
+@pytest.fixture
+def ds():
+    ds = synthetic_two_level_dataset(n_time=12, n_rlat=9, n_rlon=11)
+    # ties: both levels at the same height (idxmin/idxmax pick the first level)
+    height = ds["height"].values
+    height[:, 1, 0, :] = height[:, 0, 0, :]
+    ds["height"] = (ds["height"].dims, height)
+    return ds
+
+
+def xr_reference(ds, hub_height):
+    return calculate_hub_height_xr(ds, "IDL", hub_height=hub_height)["S_hub"]
+
+
+@pytest.mark.parametrize("memory_budget", [2e9, 5e4])  # one or several time chunks
+def test_single_hub_height(ds, memory_budget):
+    result = calculate_hub_height_chunked(
+        ds, "IDL", hub_height=100, memory_budget=memory_budget
+    )["S_hub"]
+    expected = xr_reference(ds, 100)
+    np.testing.assert_allclose(
+        result.transpose(*expected.dims).values, expected.values, rtol=1e-12
+    )
+    assert np.isnan(result.isel(rlat=0)).all()  # ties give NaN in both
+
+
+def test_swapped_level_order(ds):
+    ds_swapped = ds.isel(mlev=[1, 0])
+    expected = xr_reference(ds, 100)
+    for ds_levels in [ds, ds_swapped]:
+        result = calculate_hub_height_chunked(ds_levels, "IDL", hub_height=100)
+        np.testing.assert_allclose(
+            result["S_hub"].transpose(*expected.dims).values,
+            expected.values,
+            rtol=1e-12,
+        )
+        np.testing.assert_allclose(
+            xr_reference(ds_levels, 100).values, expected.values, rtol=1e-12
+        )
+
+
+def test_list_of_hub_heights(ds):
+    hub_heights = [80, 100, 120, 150]
+    expected = xr.concat(
+        [xr_reference(ds, h).drop_vars("mlev") for h in hub_heights],
+        dim=pd.Index(hub_heights, name="hub_height"),
+    )
+    result = calculate_hub_height_chunked(ds, "IDL", hub_height=hub_heights)["S_hub"]
+    np.testing.assert_allclose(
+        result.transpose(*expected.dims).values, expected.values, rtol=1e-12
+    )
+
+
+def test_kernel_on_numpy(ds):
+    s = ds["S"].transpose("time", "rlat", "rlon", "mlev").values
+    z = ds["height"].transpose("time", "rlat", "rlon", "mlev").values
+    single = hub_height_kernel(s, z, 100)
+    several = hub_height_kernel(s, z, [100, 120])
+    assert several.shape == single.shape + (2,)
+    np.testing.assert_array_equal(several[..., 0], single)
+    np.testing.assert_allclose(
+        single, xr_reference(ds, 100).transpose("time", "rlat", "rlon"), rtol=1e-12
+    )
@@ -0,0 +1,84 @@
+# Tests of the streaming statistics (online_statistics.py) against numpy and the
+# previous xarray computations (time means and seasonal groupby means) on synthetic
+# monthly wind speeds with missing values. Run with python -m pytest from code/.
+
+import numpy as np
+import pandas as pd
+import pytest
+import xarray as xr
+from online_statistics import SEASONS, OnlineMoments, change_statistics
+
+
+def synthetic_S(seed=0, n_years=3):
+    """
+    Monthly wind speeds (experiment, time, lev, rlat, rlon) with 10 % NaNs, one cell
+    without data and one cell with a single value
+    """
+    rng = np.random.default_rng(seed)
+    time = pd.date_range("1986-01-01", periods=12 * n_years, freq="MS")
+    shape = (2, time.size, 3, 5, 6)
+    S = rng.gamma(4.0, 2.0, shape)
+    S[rng.random(shape) < 0.1] = np.nan
+    S[:, :, :, 0, 0] = np.nan
+    S[:, 1:, :, 0, 1] = np.nan
+    return xr.Dataset(
+        {"S": (("experiment", "time", "lev", "rlat", "rlon"), S)},
+        coords={
+            "experiment": ["GRASS", "FOREST"],
+            "time": time,
+            "lev": [25.0, 26.0, 27.0],
+            "rlat": np.arange(5) * 0.44,
+            "rlon": np.arange(6) * 0.44,
+        },
+    )
+
+
+@pytest.fixture
+def da():
+    return synthetic_S()["S"].sel(experiment="GRASS", drop=True)
+
+
+def assert_moments(moments, da):
+    values = da.transpose("time", ...).values
+    with np.errstate(invalid="ignore", divide="ignore"), pytest.warns(RuntimeWarning):
+        mean = np.nanmean(values, axis=0)
+        variance = np.nanvar(values, axis=0, ddof=1)
+    variance[np.isinf(variance)] = np.nan  # single value
+    np.testing.assert_array_equal(moments.count.values, np.isfinite(values).sum(0))
+    np.testing.assert_allclose(moments.get_mean().values, mean, rtol=1e-12)
+    np.testing.assert_allclose(moments.get_variance().values, variance, rtol=1e-10)
+
+
+@pytest.mark.parametrize("time_chunk", [1, 5, 12, 36])
+def test_chunked_update(da, time_chunk):
+    moments = OnlineMoments()
+    for t in range(0, da.time.size, time_chunk):
+        moments.update(da.isel(time=slice(t, t + time_chunk)))
+    assert_moments(moments, da)
+
+
+def test_merge(da):
+    parts = [slice(0, 7), slice(7, 20), slice(20, None)]
+    accumulators = [OnlineMoments() for _ in parts]
+    for moments, part in zip(accumulators, parts):
+        moments.update(da.isel(time=part))
+    merged = OnlineMoments().merge(accumulators[0])
+    for moments in accumulators[1:] + [OnlineMoments()]:  # empty one included
+        merged.merge(moments)
+    assert_moments(merged, da)
+
+
+@pytest.mark.parametrize("season", [None] + SEASONS)
+def test_difference(season):
+    ds = synthetic_S()
+    stats = change_statistics({"GERICS": ds}, time_chunk=5)
+    # previous computation in analyze_monthly_means.calculate_changes
+    if season:
+        ds_mean = ds.groupby("time.season").mean().sel(season=season, drop=True)
+    else:
+        ds_mean = ds.mean(dim="time")
+    expected = ds_mean.sel(experiment="GRASS") - ds_mean.sel(experiment="FOREST")
+    xr.testing.assert_allclose(
+        stats["GERICS"].difference(season).transpose(*expected["S"].dims),
+        expected["S"],
+    )
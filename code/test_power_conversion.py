@@ -0,0 +1,71 @@
+# Regression tests of the array conversion of wind speeds into capacity factors
+# (Power.power_conversion_array, Power.convert) against the scalar lookup
+# Power.power_conversion. Run with python -m pytest from code/.
+
+import os
+import dask.array
+import numpy as np
+import xarray as xr
+from power_curves import load_power_curves
+from utils_from_CESM2energy import Power
+
+load_power_curves(os.path.dirname(os.path.abspath(__file__)) + "/../output/")
+
+
+def wind_speeds(P):
+    """
+    NaN, speeds below cut-in and above cut-out, on all nodes of the power curve and
+    between the nodes
+    """
+    speeds = P.speeds
+    return np.concatenate(
+        [
+            [np.nan, -np.inf, -1.0, 0.0, np.inf, 100.0],
+            speeds[0] - [1.0, 1e-9],  # below cut-in
+            speeds[-1] + [1e-9, 0.5],  # above cut-out
+            speeds,  # on the nodes, including cut-in and cut-out
+            np.nextafter(speeds, np.inf),
+            np.nextafter(speeds, -np.inf),
+            (speeds[1:] + speeds[:-1]) / 2,  # between the nodes
+            np.random.default_rng(0).uniform(-1, speeds[-1] + 1, 1000),
+            [np.nan],
+        ]
+    )
+
+
+def scalar_conversion(P, s):
+    return np.array([P.power_conversion(x) for x in s.ravel()]).reshape(s.shape)
+
+
+def test_numpy_matches_scalar():
+    P = Power(0)
+    s = wind_speeds(P)
+    expected = scalar_conversion(P, s)
+    np.testing.assert_array_equal(P.power_conversion_array(s), expected)
+    np.testing.assert_array_equal(P.convert(s), expected)
+    # higher dimensional arrays keep their shape
+    s_2d = s[: s.size // 7 * 7].reshape(-1, 7)
+    np.testing.assert_array_equal(P.convert(s_2d), expected[: s_2d.size].reshape(-1, 7))
+
+
+def test_dask_matches_scalar():
+    P = Power(0)
+    s = wind_speeds(P)
+    expected = scalar_conversion(P, s)
+    result = P.convert(dask.array.from_array(s, chunks=997))
+    assert isinstance(result, dask.array.Array)
+    np.testing.assert_array_equal(result.compute(), expected)
+
+
+def test_xarray_matches_scalar():
+    P = Power(0)
+    s = wind_speeds(P)
+    s = s[: s.size // 7 * 7].reshape(-1, 7)
+    expected = scalar_conversion(P, s)
+    da = xr.DataArray(s, dims=("time", "rlon"))
+    result = P.convert(da)
+    assert result.dims == da.dims
+    np.testing.assert_array_equal(result.values, expected)
+    result = P.convert(da.chunk({"time": 333, "rlon": 3}))
+    assert result.chunks is not None
+    np.testing.assert_array_equal(result.compute().values, expected)
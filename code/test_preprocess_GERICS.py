@@ -0,0 +1,129 @@
+# Regression tests of the GERICS destaggering kernels (compute_wind_speed,
+# interpolate_geopotential) against the rolling-mean reference implementations on a
+# small synthetic archive, and of the split of the raw output (split_raw_data,
+# preprocess_year).
+# Run with python -m pytest from code/.
+
+import os
+import pytest
+import xarray as xr
+import preprocess_GERICS
+import synthetic_data
+from preprocess_GERICS import (
+    compute_wind_speed,
+    compute_wind_speed_rolling,
+    interpolate_geopotential,
+    interpolate_geopotential_rolling,
+    preprocess_year,
+    raw_levels,
+    split_raw_data,
+)
+
+n_days = 3  # 12 timesteps at 6h resolution
+time_chunks = [1, 5, 7, 12, 124]  # 5 and 7 do not divide the number of timesteps
+
+
+@pytest.fixture(scope="module")
+def GERICS_path(tmp_path_factory):
+    root = str(tmp_path_factory.mktemp("archive")) + "/"
+    synthetic_data.write_synthetic_archive(
+        root=root, years=[1986], experiments=["GRASS"], n_days=n_days, raw_data=False
+    )
+    return root + "data/GERICS/GRASS/"
+
+
+def open_variable(GERICS_path, variable):
+    return xr.open_dataset(GERICS_path + variable + "/" + variable + "_1986.nc")
+
+
+@pytest.mark.parametrize("time_chunk", time_chunks)
+def test_compute_wind_speed(GERICS_path, time_chunk):
+    ds_u = open_variable(GERICS_path, "U")
+    ds_v = open_variable(GERICS_path, "V")
+    xr.testing.assert_allclose(
+        compute_wind_speed(ds_u, ds_v, time_chunk=time_chunk),
+        compute_wind_speed_rolling(ds_u, ds_v),
+    )
+
+
+@pytest.mark.parametrize("time_chunk", time_chunks)
+def test_interpolate_geopotential(GERICS_path, time_chunk):
+    ds = open_variable(GERICS_path, "FI")
+    ds_ground = open_variable(GERICS_path, "FIB")
+    xr.testing.assert_allclose(
+        interpolate_geopotential(ds, ds_ground, time_chunk=time_chunk),
+        interpolate_geopotential_rolling(ds, ds_ground),
+    )
+
+
+def test_interpolate_geopotential_raw_levels(GERICS_path):
+    ds = open_variable(GERICS_path, "FI")
+    ds_ground = open_variable(GERICS_path, "FIB")
+    ds_reduced = ds.sel(lev_2=raw_levels)
+    FI_reduced = interpolate_geopotential(ds_reduced, ds_ground, time_chunk=5)
+    xr.testing.assert_allclose(
+        FI_reduced, interpolate_geopotential_rolling(ds_reduced, ds_ground)
+    )
+    xr.testing.assert_allclose(
+        FI_reduced["FI"],
+        interpolate_geopotential(ds, ds_ground)["FI"].sel(lev=raw_levels),
+    )
+    with pytest.raises(ValueError):
+        interpolate_geopotential(ds.sel(lev_2=[22.0, 24.0, 27.0]), ds_ground)
+    with pytest.raises(ValueError):  # lowest level missing
+        interpolate_geopotential(ds.sel(lev_2=[22.0, 23.0, 24.0, 25.0]), ds_ground)
+
+
+def test_split_raw_data(GERICS_path, tmp_path, monkeypatch):
+    # raw output: one file per timestep with all variables on all levels
+    ds_raw = xr.merge(
+        [open_variable(GERICS_path, variable) for variable in ["U", "V", "FI", "FIB"]]
+    )
+    ds_raw["T"] = ds_raw["U"].isel(rlon_2=0, drop=True) + 273.15
+    ds_raw["PS"] = ds_raw["FIB"] * 0 + 1e5
+    monkeypatch.setattr(preprocess_GERICS, "data_path", str(tmp_path) + "/")
+    os.makedirs(str(tmp_path) + "/GRASS/raw_data")
+    for i in range(ds_raw.time.size):
+        ds_raw.isel(time=[i]).to_netcdf(
+            str(tmp_path) + "/GRASS/raw_data/e062008t1986" + str(i).zfill(4) + ".nc"
+        )
+    split_raw_data(1986, "GRASS", levels=raw_levels)
+    assert sorted(os.listdir(str(tmp_path) + "/GRASS")) == sorted(
+        ["raw_data", "FIB", "U", "V", "FI", "FI_interpolated", "S"]
+    )
+    for variable in ["U", "V", "FI", "FIB"]:
+        ds_split = xr.open_dataset(
+            str(tmp_path) + "/GRASS/" + variable + "/" + variable + "_1986.nc"
+        )
+        expected = ds_raw[variable]
+        if "lev_2" in expected.dims:
+            expected = expected.sel(lev_2=raw_levels)
+        xr.testing.assert_allclose(ds_split[variable], expected)
+        assert "rotated_pole" in ds_split
+
+
+def test_preprocess_synthetic_raw_data(tmp_path, monkeypatch):
+    # full preprocessing (split included) of the raw output of the synthetic archive
+    root = str(tmp_path) + "/"
+    synthetic_data.write_synthetic_archive(
+        root=root, years=[1986], experiments=["GRASS"], n_days=1
+    )
+    GERICS_path = root + "data/GERICS/GRASS/"
+    assert len(os.listdir(GERICS_path + "raw_data")) == 4
+    ds_all = {
+        variable: xr.load_dataset(GERICS_path + variable + "/" + variable + "_1986.nc")
+        for variable in ["U", "V", "FI", "FIB"]
+    }
+    monkeypatch.setattr(preprocess_GERICS, "data_path", root + "data/GERICS/")
+    preprocess_year((1986, "GRASS"))
+    xr.testing.assert_allclose(
+        open_variable(GERICS_path, "FI")["FI"], ds_all["FI"]["FI"].sel(lev_2=raw_levels)
+    )
+    xr.testing.assert_allclose(
+        xr.open_dataset(GERICS_path + "FI_interpolated/FI_1986.nc")["FI"],
+        interpolate_geopotential(ds_all["FI"], ds_all["FIB"])["FI"].sel(lev=raw_levels),
+    )
+    xr.testing.assert_allclose(
+        open_variable(GERICS_path, "S")["S"],
+        compute_wind_speed(ds_all["U"], ds_all["V"])["S"],
+    )
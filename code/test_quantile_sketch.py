@@ -0,0 +1,57 @@
+# Tests of the quantile sketch (quantile_sketch.QuantileSketch) against np.quantile:
+# the rank error stays within the documented 2 / k, also after merging sketches.
+# Run with python -m pytest from code/.
+
+import numpy as np
+import pytest
+from quantile_sketch import QuantileSketch
+
+k = 200
+quantiles = np.linspace(0.01, 0.99, 99)
+
+
+def rank_error(values, sketch):
+    """
+    Largest deviation of the ranks of the sketch quantiles from the requested ranks
+    """
+    values = np.sort(values[np.isfinite(values)])
+    ranks = np.searchsorted(values, sketch.quantile(quantiles), side="right")
+    return np.abs(ranks / values.size - quantiles).max()
+
+
+@pytest.fixture
+def values():
+    rng = np.random.default_rng(1)
+    values = np.concatenate([rng.normal(0, 1, 60000), rng.gamma(2.0, 3.0, 40000)])
+    values[rng.random(values.size) < 0.05] = np.nan
+    return values
+
+
+def test_exact_below_capacity(values):
+    sketch = QuantileSketch(k).update(values[: k // 2])
+    expected = np.nanquantile(values[: k // 2], quantiles, method="inverted_cdf")
+    np.testing.assert_array_equal(sketch.quantile(quantiles), expected)
+
+
+@pytest.mark.parametrize("batch_size", [1000, 100000])
+def test_rank_error(values, batch_size):
+    sketch = QuantileSketch(k)
+    for i in range(0, values.size, batch_size):
+        sketch.update(values[i : i + batch_size])
+    assert sketch.n == np.isfinite(values).sum()
+    assert rank_error(values, sketch) <= 2 / k
+
+
+def test_merge(values):
+    # parts with different distributions, as for blocks of grid cells
+    parts = np.split(values, [30000, 60000, 80000])
+    sketches = [QuantileSketch(k, seed=i).update(part) for i, part in enumerate(parts)]
+    merged = sketches[0]
+    for sketch in sketches[1:]:
+        merged.merge(sketch)
+    assert merged.n == np.isfinite(values).sum()
+    assert rank_error(values, merged) <= 2 / k
+
+
+def test_empty():
+    assert np.isnan(QuantileSketch(k).update([np.nan]).quantile([0.5])).all()
@@ -0,0 +1,185 @@
+# Consolidated Zarr stores for hub height winds and capacity factors.
+# All years of one institution and experiment are appended to a single store with
+# time-contiguous chunks (long in time, small in space) and consolidated metadata,
+# so that analyses open all 30 years at once without scanning 30 NetCDF files.
+# The time slices of the individual years are recorded in the store attributes
+# (GERICS times are not always decodable), which allows selecting and exporting
+# single years, together with the size and modification time of the file each year
+# was appended from, so that only new years are appended on the next run. Years are
+# kept in chronological order (the store is rebuilt if an earlier year is added).
+
+import os
+import shutil
+import xarray as xr
+from file_signature import source_signature
+from output_encoding import PROFILES, encoding, write_dataset
+
+store_profile = "store"
+
+
+def hub_height_store(ins, experiment):
+    return "../output/hub_height_wind/S_hub_" + ins + "_" + experiment + ".zarr"
+
+
+def CF_store(ins, experiment, turbine_name="SWT120_3600"):
+    return (
+        "../output/generation/" + ins + "_" + turbine_name + "_" + experiment + ".zarr"
+    )
+
+
+def stored_years(store):
+    """
+    Years contained in store, empty if the store does not exist
+    """
+    if not os.path.exists(store):
+        return []
+    return list(xr.open_zarr(store, consolidated=True).attrs["years"])
+
+
+def _aligned_time_chunks(n_stored, n_new, chunk):
+    """
+    Chunk sizes along time such that every dask chunk maps onto whole chunks of the
+    store (the first one completes the last, partially filled chunk)
+    """
+    first = min((chunk - n_stored % chunk) % chunk or chunk, n_new)
+    chunks = [first]
+    while sum(chunks) < n_new:
+        chunks.append(min(chunk, n_new - sum(chunks)))
+    return tuple(chunks)
+
+
+def stored_sources(store):
+    """
+    Source signature (see file_signature.source_signature) of every year in store
+    """
+    if not os.path.exists(store):
+        return {}
+    attrs = xr.open_zarr(store, consolidated=True).attrs
+    years = [int(year) for year in attrs["years"]]
+    return dict(zip(years, attrs.get("sources", [""] * len(years))))
+
+
+def append_year(ds, store, year, packing=None, source=""):
+    """
+    Append one year to store (created if needed). Years that are already contained
+    are skipped, so that interrupted consolidations can be restarted. Years earlier
+    than the last contained year raise a ValueError (see build_store).
+    :param ds: xr.Dataset of one year with time dimension
+    :param packing: see output_encoding.encoding
+    :param source: signature of the file the year is read from (see build_store)
+    :return: True if the year was appended
+    """
+    years = stored_years(store)
+    if int(year) in years:
+        return False
+    if years and int(year) < max(years):
+        # appending would make the time axis non-monotonic
+        raise ValueError(
+            str(year) + " is earlier than the last year in " + store + ", rebuild it"
+        )
+    time_chunk = PROFILES[store_profile]["chunks"]["time"]
+    ds = ds.copy()
+    for var in ds.variables:
+        ds[var].encoding = {
+            key: value
+            for key, value in ds[var].encoding.items()
+            if key in ["units", "calendar"]
+        }
+    if years:
+        attrs = xr.open_zarr(store, consolidated=True).attrs
+        offsets = list(attrs["year_offsets"])
+        ds = ds.chunk(
+            {"time": _aligned_time_chunks(offsets[-1], ds.time.size, time_chunk)}
+        )
+        ds.attrs.update(
+            {
+                "years": years + [int(year)],
+                "year_offsets": offsets + [offsets[-1] + ds.time.size],
+                "sources": list(attrs.get("sources", [""] * len(years))) + [source],
+            }
+        )
+        ds.to_zarr(store, mode="a", append_dim="time", consolidated=True)
+    else:
+        encodings = encoding(ds, store_profile, packing, zarr=True)
+        for var in encodings:
+            # the time chunk is not limited to the length of the first year
+            encodings[var]["chunks"] = tuple(
+                time_chunk if dim == "time" else size
+                for dim, size in zip(ds[var].dims, encodings[var]["chunks"])
+            )
+        ds = ds.chunk({"time": time_chunk})
+        ds.attrs.update(
+            {
+                "years": [int(year)],
+                "year_offsets": [0, ds.time.size],
+                "sources": [source],
+            }
+        )
+        ds.to_zarr(store, mode="w", encoding=encodings, consolidated=True)
+    return True
+
+
+def build_store(filenames, store, years, packing=None, overwrite=False):
+    """
+    Append yearly NetCDF files to store in chronological order. Only years that are
+    not yet contained are read and appended. If a file of a contained year has changed
+    since it was appended (e.g. it was recomputed), or a missing year is earlier than
+    the last contained year, the store is rebuilt so that time stays sorted.
+    :param filenames: list of yearly files
+    :param years: year of each file
+    :param overwrite: if True, an existing store is replaced instead of extended
+    """
+    sources = stored_sources(store)
+    for filename, year in zip(filenames, years):
+        if int(year) in sources and sources[int(year)] != source_signature(filename):
+            print(filename + " changed, rebuilding " + store)
+            overwrite = True
+            break
+    missing = [int(year) for year in years if int(year) not in sources]
+    if not overwrite and missing and sources and min(missing) < max(sources):
+        print(str(min(missing)) + " precedes stored years, rebuilding " + store)
+        overwrite = True
+    if overwrite and os.path.exists(store):
+        shutil.rmtree(store)
+    for filename, year in sorted(zip(filenames, years), key=lambda x: int(x[1])):
+        if not overwrite and int(year) in sources:
+            continue
+        with xr.open_dataset(filename, chunks={}) as ds:
+            if append_year(ds, store, year, packing, source_signature(filename)):
+                print("appended " + str(year) + " to " + store)
+
+
+def open_store(store):
+    """
+    Open all years of a store lazily (only the consolidated metadata is read)
+    """
+    return xr.open_zarr(store, consolidated=True)
+
+
+def select_year(ds, year):
+    """
+    Select one year from a dataset opened with open_store
+    """
+    i_year = list(ds.attrs["years"]).index(int(year))
+    offsets = ds.attrs["year_offsets"]
+    return ds.isel(time=slice(offsets[i_year], offsets[i_year + 1]))
+
+
+def export_netcdf(
+    store, filename_pattern, years=None, profile="time_series", packing=None
+):
+    """
+    Write the per-year NetCDF layout from a store
+    :param filename_pattern: target filenames containing {year}, e.g.
+        "../output/generation/IDL_SWT120_3600_{year}_GRASS.nc"
+    :param years: years to export, defaults to all years in store
+    """
+    ds = open_store(store)
+    for year in years or ds.attrs["years"]:
+        ds_year = select_year(ds, year)
+        ds_year.attrs = {
+            key: value
+            for key, value in ds.attrs.items()
+            if key not in ["years", "year_offsets"]
+        }
+        write_dataset(ds_year, filename_pattern.format(year=year), profile, packing)
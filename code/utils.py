@@ -99,6 +99,24 @@ def constrain_vertical_range(ds, institution):
     return ds
 
 
+# timesteps shared by hourly (IDL) and 6-hourly (GERICS) output
+synoptic_hours = [0, 6, 12, 18]
+
+
+def select_synoptic_times(ds, hours=synoptic_hours):
+    """
+    Select the timesteps at the given full hours (UTC) by their time labels, e.g. to
+    compare hourly IDL with 6-hourly GERICS output. Can be used as preprocess in
+    xr.open_mfdataset so that only these timesteps are read.
+    """
+    time = ds.indexes["time"]
+    return ds.isel(
+        time=np.flatnonzero(
+            np.isin(time.hour, hours) & (time.minute == 0) & (time.second == 0)
+        )
+    )
+
+
 def get_focus_area(ds, area_name):
     assert area_name in ["Sweden", "Germany", "Spain"]
     if area_name == "Sweden":
@@ -162,30 +180,88 @@ def compute_land_sea_mask(other=np.nan, save=True, plot=True, monthly=False):
     return ds_mask
 
 
-def restrict_to_land(ds, monthly=True, variable_name="S"):
+land_sea_masks = {}  # LandSeaMask per mask file and grid, see get_land_sea_mask
+
+
+class LandSeaMask:
     """
-    Exclude data over oceans and restrict to domain of interest
+    Land-sea mask on the grid of the wind data
 
-    This function is only demonstrated to work for IDL and GERICS data because of the different grid sizes!
+    mask: boolean DataArray (rlat, rlon), True for onshore cells in the domain of interest
+    land_index: flat indices of the onshore cells in the (rlat, rlon) grid
     """
-    filename = "land_sea_mask"
-    if monthly:
-        filename += "_monthly"
-    try:
-        land_sea_mask = xr.open_dataarray("../output/" + filename + ".nc")
-    except:
-        land_sea_mask = compute_land_sea_mask(plot=False, monthly=True)
 
-    # GERICS simulations have larger outputs and need to be cropped
+    def __init__(self, mask):
+        self.mask = mask
+        self.land_index = np.flatnonzero(mask.values)
+
+    def apply(self, da):
+        """
+        Set all cells that are not onshore to NaN
+        """
+        return da.where(self.mask)
+
+    def gather(self, da):
+        """
+        Values of the onshore cells only, rlat and rlon are replaced by a dimension "cell"
+        """
+        other_dims = [dim for dim in da.dims if dim not in ["rlat", "rlon"]]
+        da = da.transpose(*other_dims, "rlat", "rlon")
+        values = da.data.reshape(da.shape[:-2] + (-1,))[..., self.land_index]
+        return xr.DataArray(
+            values,
+            dims=other_dims + ["cell"],
+            coords={dim: da[dim] for dim in other_dims if dim in da.coords},
+        )
+
+
+def crop_to_land_sea_mask(ds):
+    """
+    GERICS simulations have larger outputs and need to be cropped to the grid of the
+    land sea mask
+    """
     if ds.rlat.size > 104:
         ds = ds.isel(rlon=slice(8, -15), rlat=slice(8, -10))
+    return ds
+
+
+def get_land_sea_mask(ds, monthly=True):
+    """
+    LandSeaMask on the grid of ds (after crop_to_land_sea_mask). The mask file is only
+    read once per process and grid, None if the grids do not match.
+    """
+    filename = "../output/land_sea_mask"
+    if monthly:
+        filename += "_monthly"
+    filename += ".nc"
+    key = (filename, ds.rlat.size, ds.rlon.size, ds.rlat.values[0], ds.rlon.values[0])
+    if key not in land_sea_masks:
+        try:
+            land_sea_mask = xr.load_dataarray(filename)
+        except FileNotFoundError:
+            land_sea_mask = compute_land_sea_mask(plot=False, monthly=monthly)
+
+        # Grids are typically off by a small margin. Use coordinates of the provided dataset
+        # also for the land sea if the deviation is less than 5% of the grid spacing
+        if np.abs((land_sea_mask.rlat.values - ds.rlat.values).mean()) >= 0.05 * 0.44:
+            print("Grids of land sea mask and wind data do not match")
+            return None
+        mask = xr.DataArray(
+            (land_sea_mask == 1).transpose("rlat", "rlon").values,
+            dims=["rlat", "rlon"],
+            coords={"rlat": ds.rlat.values, "rlon": ds.rlon.values},
+        )
+        land_sea_masks[key] = LandSeaMask(mask)
+    return land_sea_masks[key]
+
+
+def restrict_to_land(ds, monthly=True, variable_name="S"):
+    """
+    Exclude data over oceans and restrict to domain of interest
 
-    # Grids are typically off by a small margin. Use coordinates of the provided dataset
-    # also for the land sea if the deviation is less than 5% of the grid spacing
-    if np.abs((land_sea_mask.rlat.values - ds.rlat.values).mean()) < 0.05 * 0.44:
-        land_sea_mask["rlat"] = ds.rlat
-        land_sea_mask["rlon"] = ds.rlon
-        ds_masked = (land_sea_mask * ds[variable_name]).to_dataset(name=variable_name)
-        return ds_masked
-    else:
-        print("Grids of land sea mask and wind data do not match")
+    This function is only demonstrated to work for IDL and GERICS data because of the different grid sizes!
+    """
+    ds = crop_to_land_sea_mask(ds)
+    land_sea_mask = get_land_sea_mask(ds, monthly)
+    if land_sea_mask is not None:
+        return land_sea_mask.apply(ds[variable_name]).to_dataset(name=variable_name)
@@ -2,10 +2,12 @@
 # These functions are adapted from https://github.com/jwohland/wind_n_solar
 
 import pandas as pd
-import glob
 import time
 import numpy as np
 import xarray as xr
+import dask.array
+from power_curves import get_power_curve
+from output_encoding import write_dataset
 
 out_path = "../output/generation/"
 
@@ -17,12 +19,19 @@ class Power:
     """
 
     def __init__(self, turbine_index):
-        self.power_curve = pd.read_pickle(
-            sorted(glob.glob("../output/*.p"))[turbine_index]
-        )
-        self.turbine_name = self.power_curve.keys()[0].replace(
-            "/", "_"
-        )  # / leads to issues when saving
+        # turbine_index is the index in sorted file order or the turbine name
+        compiled_curve = get_power_curve(turbine_index)
+        self.power_curve = compiled_curve.curve
+        self.speeds = compiled_curve.speeds
+        self.power = compiled_curve.power
+        self.turbine_name = compiled_curve.name
+
+    def __getstate__(self):
+        # only the name is sent to worker processes, curves come from the registry
+        return {"turbine_name": self.turbine_name}
+
+    def __setstate__(self, state):
+        self.__init__(state["turbine_name"])
 
     def power_conversion(self, s):
         """
@@ -41,6 +50,44 @@ class Power:
             out = idx.values[0]
         return float(out)
 
+    def power_conversion_array(self, s):
+        """
+        Array version of power_conversion. Translates a whole numpy array of wind
+        speeds into capacity factors in one call using a binary search on the
+        power curve index. Results are identical to power_conversion applied
+        element-wise (including cut-in, cut-out and NaN handling).
+        :param s: numpy array of wind speeds
+        :return: numpy array of capacity factors with the same shape as s
+        """
+        speeds = self.speeds
+        s = np.asarray(s, dtype=float)
+        # first index strictly larger than s, as in power_conversion
+        idx = np.searchsorted(speeds, s, side="right")
+        out = self.power[np.clip(idx, 0, speeds.size - 1)]
+        out = np.where(
+            (s <= speeds[0]) | (s >= speeds[-1]), 0.0, out
+        )  # below cut_in or above cut_out
+        return np.where(np.isnan(s), np.nan, out)
+
+    def convert(self, s):
+        """
+        Translate wind speeds into capacity factors. Works on numpy arrays as
+        well as on dask arrays and xarray DataArrays (dask data is converted
+        chunk by chunk).
+        :param s: wind speeds as np.ndarray, dask array or xr.DataArray
+        :return: capacity factors of the same type and shape as s
+        """
+        if isinstance(s, xr.DataArray):
+            return xr.apply_ufunc(
+                self.power_conversion_array,
+                s,
+                dask="parallelized",
+                output_dtypes=[float],
+            )
+        elif isinstance(s, dask.array.Array):
+            return s.map_blocks(self.power_conversion_array, dtype=float)
+        return self.power_conversion_array(s)
+
 
 def update_attrs(ds, var, unitname, varname, long_varname):
     """
@@ -58,40 +105,75 @@ def update_attrs(ds, var, unitname, varname, long_varname):
     return ds
 
 
-def convert_winds(ds, filename):
+def power_conversion_stacked(s, powers):
     """
-    Convert wind speeds to wind capacity factors for the three turbines
+    Translate wind speeds into capacity factors for several turbines at once.
+    The wind speeds are only read once and turbines that share the same wind speed
+    grid in their power curves also share the binary search.
+    :param s: numpy array of wind speeds
+    :param powers: list of Power objects
+    :return: numpy array of shape s.shape + (len(powers),)
+    """
+    s = np.asarray(s, dtype=float)
+    out = np.empty(s.shape + (len(powers),))
+    nan_mask = np.isnan(s)
+    idx, speeds = None, None
+    for i, P in enumerate(powers):
+        if speeds is None or not np.array_equal(speeds, P.speeds):
+            speeds = P.speeds
+            idx = np.clip(np.searchsorted(speeds, s, side="right"), 0, speeds.size - 1)
+            # below cut_in or above cut_out
+            outside = (s <= speeds[0]) | (s >= speeds[-1])
+        out[..., i] = np.where(outside, 0.0, P.power[idx])
+    out[nan_mask] = np.nan
+    return out
+
+
+def convert_winds(ds, filename, turbine_indices=range(3), single_file=False):
+    """
+    Convert wind speeds to wind capacity factors for several turbines (default: the three
+    turbines) in one pass over the wind speeds
     :param ds: xr.dataset with hub height wind speeds available as "s_hub"
     :param filename:
-    :return:
+    :param turbine_indices: indices of the power curves in ../output/
+    :param single_file: if True, all turbines are saved in one file with a turbine
+        dimension, otherwise one file per turbine is written (the capacity factors of
+        all turbines are then held in memory)
+    :return: xr.dataset with capacity factors along the turbine dimension
     """
-    wind_power_list = []
-    for turbine_index in range(3):
-        # Open power curves if they exists, otherwise compute them
-        try:
-            P = Power(turbine_index)
-        except:
-            """ You need to download the power curves and store them in ../output"""
-        print(P.turbine_name)
-
-        t_0 = time.time()
-        wind_power = xr.apply_ufunc(
-            P.power_conversion, ds["s_hub"], vectorize=True, dask="allowed"
-        ).to_dataset()
-        wind_power = update_attrs(
-            wind_power, "s_hub", "", "CF_wind", "normalized_wind_power_generation"
-        )
-        wind_power["turbine"] = P.turbine_name
-        print("wind power conversion took " + str(time.time() - t_0))
-        t_0 = time.time()
-        wind_power.to_netcdf(out_path + P.turbine_name + "/" + filename)
-        print("saving took " + str(int(time.time() - t_0)) + " s")
-        wind_power_list.append(wind_power)
-    wind_power = xr.concat(
-        wind_power_list,
-        dim=pd.Index(
-            [Power(turbine_index).turbine_name for turbine_index in range(3)],
-            name="turbine",
-        ),
+    # You need to download the power curves and store them in ../output.
+    # turbine_indices can also contain turbine names
+    powers = [Power(turbine_index) for turbine_index in turbine_indices]
+    turbine_names = [P.turbine_name for P in powers]
+    print(turbine_names)
+
+    wind_power = xr.apply_ufunc(
+        power_conversion_stacked,
+        ds["s_hub"],
+        kwargs={"powers": powers},
+        output_core_dims=[["turbine"]],
+        dask="parallelized",
+        output_dtypes=[float],
+        dask_gufunc_kwargs={"output_sizes": {"turbine": len(powers)}},
+    ).to_dataset()
+    wind_power = update_attrs(
+        wind_power, "s_hub", "", "CF_wind", "normalized_wind_power_generation"
     )
+    wind_power["turbine"] = pd.Index(turbine_names, name="turbine")
+    wind_power = wind_power.transpose("turbine", ...)
+    t_0 = time.time()
+    packing = {"CF_wind": "capacity_factor"}
+    if single_file:
+        write_dataset(wind_power, out_path + filename, packing=packing)
+    else:
+        # the conversion is computed once for all turbines (wind speeds are read once)
+        # and held in memory, otherwise every file would recompute it
+        wind_power = wind_power.persist()
+        for turbine_name in turbine_names:
+            write_dataset(
+                wind_power.sel(turbine=turbine_name),
+                out_path + turbine_name + "/" + filename,
+                packing=packing,
+            )
+    print("conversion and saving took " + str(int(time.time() - t_0)) + " s")
     return wind_power
@@ -0,0 +1,164 @@
+# Access to wind speeds and heights of the two model levels used for the hub height
+# interpolation (compute_hub_height.py, compute_power.py).
+# Static fields (IDL orography, GERICS surface geopotential if it does not change in
+# time) are read once per process and cached. Whether the GERICS surface geopotential
+# changes in time is only checked on the first year of each experiment. The yearly
+# files are opened lazily with dask chunks. IDL coordinates differ between files by
+# rounding errors; instead of rounding the coordinates of every dataset, they are
+# snapped onto the rounded grid of the cached orography by reusing its index.
+
+import numpy as np
+import xarray as xr
+from file_signature import source_signature
+
+data_dir = "../data/"
+IDL_levels = [0, 1]  # around 28m and 97m
+GERICS_levels = [26, 27]
+IDL_orography_file = (
+    data_dir + "IDL/orog_EUR-44_ECMWF-ERAINT_LUCAS_EVAL_r1i1p1_IDL_WRFV381D_v1_fx.nc"
+)
+# static DataArrays per file and source signature, GERICS FIB per experiment
+static_fields = {}
+
+
+def _cached_static(filename, load):
+    """
+    load(filename) once per process (again if the file changes)
+    """
+    key = (filename, source_signature(filename))
+    if key not in static_fields:
+        static_fields[key] = load(filename)
+    return static_fields[key]
+
+
+def _load_orography(filename):
+    orog = xr.load_dataset(filename)["orog"].drop_vars(["lon", "lat"], errors="ignore")
+    # coordinates are off by a rounding error. Corrected here once
+    return orog.assign_coords(
+        {rdim: np.round(orog[rdim], 2) for rdim in ["rlat", "rlon"]}
+    )
+
+
+def IDL_orography():
+    """
+    Orography of IDL on the rounded grid
+    """
+    return _cached_static(IDL_orography_file, _load_orography)
+
+
+def GERICS_FIB_filename(experiment, year):
+    return data_dir + "GERICS/" + experiment + "/FIB/FIB_" + year + ".nc"
+
+
+def _load_surface_geopotential(filename):
+    """
+    FIB of filename as a single (time independent) field if it is constant in time,
+    None otherwise
+    """
+    with xr.open_dataset(filename, chunks={}) as ds:
+        FIB = ds["FIB"]
+        if "time" in FIB.dims:
+            first = FIB.isel(time=0, drop=True)
+            if not bool((FIB == first).all()):
+                return None
+            FIB = first
+        return FIB.load()
+
+
+def GERICS_surface_geopotential(experiment, year):
+    """
+    Surface geopotential FIB of GERICS. Whether FIB is constant in time is checked once
+    per experiment and process, on the first year that is opened. If it is, this
+    single field is used for all years (as long as the first timestep of the year
+    agrees with it), otherwise FIB of the year is opened lazily.
+    """
+    key = ("GERICS FIB", experiment)
+    if key not in static_fields:
+        static_fields[key] = _load_surface_geopotential(
+            GERICS_FIB_filename(experiment, year)
+        )
+    FIB = xr.open_dataset(GERICS_FIB_filename(experiment, year), chunks={})["FIB"]
+    FIB_static = static_fields[key]
+    if FIB_static is not None:
+        first = FIB.isel(time=0, drop=True) if "time" in FIB.dims else FIB
+        if np.array_equal(first.values, FIB_static.values):
+            FIB.close()
+            return FIB_static
+    return FIB
+
+
+def snap_to_grid(ds, grid, tolerance=0.005):
+    """
+    Use the rlat/rlon index of grid for ds if the coordinates agree within tolerance
+    """
+    for rdim in ["rlat", "rlon"]:
+        if ds[rdim].size != grid[rdim].size or (
+            np.abs(ds[rdim].values - grid[rdim].values).max() > tolerance
+        ):
+            raise ValueError("Grid of dataset does not match the reference grid")
+    return ds.assign_coords(rlat=grid.rlat, rlon=grid.rlon)
+
+
+def wind_filename(ins, year, experiment):
+    """
+    Yearly file of the wind speeds S on all model levels
+    """
+    if ins == "GERICS":
+        return data_dir + "GERICS/" + experiment + "/S/S_" + year + ".nc"
+    return data_dir + "IDL/" + experiment + "/S/" + year + ".nc"
+
+
+def select_levels(ds, ins):
+    """
+    The two model levels close to hub height
+    """
+    if ins == "GERICS":
+        return ds.sel(lev=GERICS_levels)
+    return ds.isel(mlev=IDL_levels)
+
+
+def open_wind_geopotential(ins, year, experiment):
+    """
+    Wind speeds S and heights above ground of the two model levels close to hub height
+    of one year, opened lazily
+    """
+    if ins == "GERICS":
+        ds_GERICS_FI = xr.open_dataset(
+            data_dir + "GERICS/" + experiment + "/FI_interpolated/FI_" + year + ".nc",
+            chunks={},
+        ).sel(lev=GERICS_levels)
+        ds_GERICS_height = ds_GERICS_FI["FI"] - GERICS_surface_geopotential(
+            experiment, year
+        )
+
+        ds_wind = select_levels(
+            xr.open_dataset(wind_filename(ins, year, experiment), chunks={}), ins
+        ).drop_vars(["rotated_pole", "hyai", "hybi", "hyam", "hybm"])
+        ds_wind["height"] = ds_GERICS_height
+    elif ins == "IDL":
+        orog = IDL_orography()
+        ds_IDL_zg = xr.open_dataset(
+            data_dir
+            + "IDL/"
+            + experiment
+            + "/zg/zg_EUR-44_ECMWF-ERAINT_LUCAS_"
+            + experiment
+            + "_r1i1p1_IDL_WRFV381D_v1_1hr_"
+            + year
+            + "010100-"
+            + year
+            + "123123.nc",
+            chunks={},
+        ).isel(mlev=IDL_levels)
+        ds_wind = select_levels(
+            xr.open_dataset(wind_filename(ins, year, experiment), chunks={}), ins
+        ).drop_vars(["rotated_pole", "time_bnds"])
+        ds_IDL_zg = snap_to_grid(ds_IDL_zg, orog)
+        ds_wind = snap_to_grid(ds_wind, orog)
+        ds_wind["height"] = ds_IDL_zg["zg"] - orog
+        ds_wind = ds_wind.assign_coords(
+            {"mlev": ds_wind.mlev}
+        )  # mlev is not registered as a coordinate
+    else:
+        print("Only GERICS and IDL currently implemented")
+    return ds_wind